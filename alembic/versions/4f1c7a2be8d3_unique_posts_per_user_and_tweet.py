@@ -0,0 +1,36 @@
+"""unique posts per user and tweet
+
+Revision ID: 4f1c7a2be8d3
+Revises: 9d95da97e0c9
+Create Date: 2026-10-18 11:40:02.187364
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1c7a2be8d3'
+down_revision = '9d95da97e0c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the first copy of every (user_id, data_id) and drop the later ones with their scores and categories
+    for child_table in ('post_sentiment_scores', 'post_is_about_category'):
+        op.execute(
+            "DELETE child FROM {} child "
+            "JOIN posts duplicate ON duplicate.id = child.post_id "
+            "JOIN posts original ON original.user_id = duplicate.user_id "
+            "AND original.data_id = duplicate.data_id AND original.id < duplicate.id".format(child_table)
+        )
+    op.execute(
+        "DELETE duplicate FROM posts duplicate "
+        "JOIN posts original ON original.user_id = duplicate.user_id "
+        "AND original.data_id = duplicate.data_id AND original.id < duplicate.id"
+    )
+    op.create_unique_constraint('posts_user_id_data_id', 'posts', ['user_id', 'data_id'])
+
+
+def downgrade():
+    op.drop_constraint('posts_user_id_data_id', 'posts', type_='unique')
@@ -0,0 +1,31 @@
+"""create keyword changes table
+
+Revision ID: 9d95da97e0c9
+Revises: 28b495605c74
+Create Date: 2026-10-18 09:12:40.511204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d95da97e0c9'
+down_revision = '28b495605c74'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'keyword_changes',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('category_id', sa.Integer, nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP, server_default=sa.func.current_timestamp()),
+    )
+    op.create_index('keyword_changes_category_id', 'keyword_changes', ['category_id'])
+
+
+def downgrade():
+    op.drop_table('keyword_changes')
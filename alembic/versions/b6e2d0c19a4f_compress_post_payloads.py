@@ -0,0 +1,105 @@
+"""compress post payloads
+
+Revision ID: b6e2d0c19a4f
+Revises: 4f1c7a2be8d3
+Create Date: 2026-10-18 13:05:51.902113
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+# Custom
+from services.payload_codec import PayloadCodec, train_dictionary
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2d0c19a4f'
+down_revision = '4f1c7a2be8d3'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 1000
+TRAINING_SAMPLES = 5000
+
+
+# The bytes as the stream sends them; the old column held a pretty printed re-serialisation
+def compact(full_object):
+    try:
+        return json.dumps(json.loads(full_object), separators=(",", ":"), ensure_ascii=False).encode()
+    except ValueError:
+        return full_object.encode()
+
+
+def rewrite_in_chunks(connection, select_sql, convert, update_sql):
+    last_id = 0
+    rewritten = 0
+    while True:
+        rows = connection.execute(sa.text(select_sql), last_id=last_id, chunk_size=CHUNK_SIZE).fetchall()
+        if not rows:
+            return rewritten
+        connection.execute(sa.text(update_sql), [dict(post_id=row[0], value=convert(row[1])) for row in rows])
+        last_id = rows[-1][0]
+        rewritten += len(rows)
+        print("Rewrote {} posts".format(rewritten))
+
+
+def upgrade():
+    op.create_table(
+        'payload_dictionaries',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('dictionary', sa.LargeBinary, nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP, server_default=sa.func.current_timestamp()),
+    )
+    op.add_column('posts', sa.Column('payload', sa.LargeBinary))
+    connection = op.get_bind()
+
+    # Train the first dictionary on the most recent posts
+    samples = [compact(row[0]) for row in connection.execute(
+        sa.text("SELECT full_object FROM posts ORDER BY id DESC LIMIT :limit"), limit=TRAINING_SAMPLES)]
+    codec = PayloadCodec()
+    if samples:
+        dictionary = train_dictionary(samples)
+        result = connection.execute(sa.text("INSERT INTO payload_dictionaries (dictionary) VALUES (:dictionary)"),
+                                    dictionary=dictionary)
+        codec = PayloadCodec({result.lastrowid: dictionary}, result.lastrowid)
+
+    sizes = {"before": 0, "after": 0}
+
+    def convert(full_object):
+        payload = codec.compress(compact(full_object))
+        sizes["before"] += len(full_object.encode())
+        sizes["after"] += len(payload)
+        return payload
+
+    rewritten = rewrite_in_chunks(
+        connection,
+        "SELECT id, full_object FROM posts WHERE id > :last_id ORDER BY id LIMIT :chunk_size",
+        convert,
+        "UPDATE posts SET payload = :value WHERE id = :post_id",
+    )
+    if rewritten:
+        print("full_object: {:.0f} bytes per post, payload: {:.0f} bytes per post, {:.0f} bytes ({:.1f}%) saved".format(
+            sizes["before"] / rewritten, sizes["after"] / rewritten,
+            (sizes["before"] - sizes["after"]) / rewritten,
+            100 * (sizes["before"] - sizes["after"]) / max(sizes["before"], 1)))
+
+    # Dropping the column drops its index too
+    op.drop_column('posts', 'full_object')
+
+
+def downgrade():
+    op.add_column('posts', sa.Column('full_object', sa.Text))
+    connection = op.get_bind()
+    codec = PayloadCodec({row[0]: row[1] for row in connection.execute(
+        sa.text("SELECT id, dictionary FROM payload_dictionaries"))})
+
+    rewrite_in_chunks(
+        connection,
+        "SELECT id, payload FROM posts WHERE id > :last_id ORDER BY id LIMIT :chunk_size",
+        lambda payload: json.dumps(json.loads(codec.decompress(payload)), indent=4, sort_keys=True),
+        "UPDATE posts SET full_object = :value WHERE id = :post_id",
+    )
+    op.drop_column('posts', 'payload')
+    op.drop_table('payload_dictionaries')
@@ -0,0 +1,150 @@
+"""store tweets once
+
+Revision ID: c3a5e81f07d2
+Revises: b6e2d0c19a4f
+Create Date: 2026-10-18 15:22:37.640918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a5e81f07d2'
+down_revision = 'b6e2d0c19a4f'
+branch_labels = None
+depends_on = None
+
+TWEET_COLUMNS = ['source_name', 'data_id', 'data_author_id', 'data_user_name', 'data_user_location', 'text',
+                 'payload', 'country_name', 'state_name', 'city_name']
+
+VIEW = "CREATE OR REPLACE VIEW post_data_categorised_view AS " \
+       "SELECT posts.user_id AS user_id, posts.id AS post_id, categories.group_category_id AS group_category_id, " \
+       "categories.id AS category_id, keywords.keywords AS keywords, tweets.text AS text, " \
+       "tweets.source_name AS post_source, tweets.data_user_location AS region, tweets.country_name AS country, " \
+       "tweets.state_name AS state, tweets.city_name AS city, " \
+       "tweet_sentiment_scores.score AS sentiment_score_value, tweet_sentiment_scores.sentiment AS sentiment_score, " \
+       "posts.created_at AS created_at " \
+       "FROM posts " \
+       "JOIN users ON posts.user_id = users.id " \
+       "JOIN tweets ON tweets.id = posts.tweet_id " \
+       "JOIN post_is_about_category ON post_is_about_category.post_id = posts.id " \
+       "JOIN categories ON post_is_about_category.category_id = categories.id " \
+       "JOIN keywords ON keywords.category_id = categories.id " \
+       "JOIN tweet_sentiment_scores ON tweet_sentiment_scores.tweet_id = posts.tweet_id"
+
+OLD_VIEW = "CREATE OR REPLACE VIEW post_data_categorised_view AS " \
+           "SELECT posts.user_id AS user_id, posts.id AS post_id, categories.group_category_id AS group_category_id, " \
+           "categories.id AS category_id, keywords.keywords AS keywords, posts.text AS text, " \
+           "posts.source_name AS post_source, posts.data_user_location AS region, posts.country_name AS country, " \
+           "posts.state_name AS state, posts.city_name AS city, " \
+           "post_sentiment_scores.score AS sentiment_score_value, post_sentiment_scores.sentiment AS sentiment_score, " \
+           "posts.created_at AS created_at " \
+           "FROM posts " \
+           "JOIN users ON posts.user_id = users.id " \
+           "JOIN post_is_about_category ON post_is_about_category.post_id = posts.id " \
+           "JOIN categories ON post_is_about_category.category_id = categories.id " \
+           "JOIN keywords ON keywords.category_id = categories.id " \
+           "JOIN post_sentiment_scores ON posts.id = post_sentiment_scores.post_id"
+
+
+def upgrade():
+    op.create_table(
+        'tweets',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('source_name', sa.String(40), nullable=False),
+        sa.Column('data_id', sa.String(100), nullable=False, unique=True),
+        sa.Column('data_author_id', sa.String(100), nullable=False),
+        sa.Column('data_user_name', sa.String(100), nullable=False),
+        sa.Column('data_user_location', sa.String(100), nullable=False),
+        sa.Column('text', sa.Text(collation='utf8mb4_bin'), nullable=False),
+        sa.Column('payload', sa.LargeBinary),
+        sa.Column('country_name', sa.String(100)),
+        sa.Column('state_name', sa.String(100)),
+        sa.Column('city_name', sa.String(100)),
+        sa.Column('created_at', sa.TIMESTAMP, nullable=True),
+        mysql_charset='utf8mb4',
+    )
+    op.create_index('tweets_created_at', 'tweets', ['created_at'])
+
+    # One tweet per data_id, taken from its first copy
+    op.execute(
+        "INSERT INTO tweets ({columns}, created_at) "
+        "SELECT {columns}, posts.created_at FROM posts "
+        "JOIN (SELECT MIN(id) AS id FROM posts GROUP BY data_id) first_copy ON first_copy.id = posts.id"
+        .format(columns=", ".join(TWEET_COLUMNS))
+    )
+    op.add_column('posts', sa.Column('tweet_id', sa.Integer))
+    op.execute("UPDATE posts JOIN tweets ON tweets.data_id = posts.data_id SET posts.tweet_id = tweets.id")
+
+    # Every copy was scored on the same text, keep the first score of each tweet
+    op.create_table(
+        'tweet_sentiment_scores',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('tweet_id', sa.Integer, sa.ForeignKey('tweets.id', ondelete='CASCADE'), nullable=False,
+                  unique=True),
+        sa.Column('sentiment', sa.String(20), nullable=False),
+        sa.Column('score', sa.Float, nullable=False),
+    )
+    op.execute(
+        "INSERT INTO tweet_sentiment_scores (tweet_id, sentiment, score) "
+        "SELECT posts.tweet_id, post_sentiment_scores.sentiment, post_sentiment_scores.score "
+        "FROM post_sentiment_scores "
+        "JOIN posts ON posts.id = post_sentiment_scores.post_id "
+        "JOIN (SELECT MIN(post_sentiment_scores.id) AS id FROM post_sentiment_scores "
+        "JOIN posts ON posts.id = post_sentiment_scores.post_id GROUP BY posts.tweet_id) first_score "
+        "ON first_score.id = post_sentiment_scores.id"
+    )
+    op.drop_table('post_sentiment_scores')
+
+    # Posts keep only who collected which tweet, and when it was created for date filtering.
+    # The new unique key goes on first so users_posts always has an index on user_id
+    op.alter_column('posts', 'tweet_id', existing_type=sa.Integer, nullable=False)
+    op.create_foreign_key('posts_tweet', 'posts', 'tweets', ['tweet_id'], ['id'], ondelete='CASCADE')
+    op.create_unique_constraint('posts_user_id_tweet_id', 'posts', ['user_id', 'tweet_id'])
+    op.create_index('posts_user_id_created_at', 'posts', ['user_id', 'created_at'])
+    op.drop_constraint('posts_user_id_data_id', 'posts', type_='unique')
+    for column in TWEET_COLUMNS:
+        op.drop_column('posts', column)
+
+    op.execute(VIEW)
+
+
+def downgrade():
+    op.add_column('posts', sa.Column('source_name', sa.String(40)))
+    op.add_column('posts', sa.Column('data_id', sa.String(100)))
+    op.add_column('posts', sa.Column('data_author_id', sa.String(100)))
+    op.add_column('posts', sa.Column('data_user_name', sa.String(100)))
+    op.add_column('posts', sa.Column('data_user_location', sa.String(100)))
+    op.add_column('posts', sa.Column('text', sa.Text(collation='utf8mb4_bin')))
+    op.add_column('posts', sa.Column('payload', sa.LargeBinary))
+    op.add_column('posts', sa.Column('country_name', sa.String(100)))
+    op.add_column('posts', sa.Column('state_name', sa.String(100)))
+    op.add_column('posts', sa.Column('city_name', sa.String(100)))
+    op.execute(
+        "UPDATE posts JOIN tweets ON tweets.id = posts.tweet_id SET {}"
+        .format(", ".join("posts.{0} = tweets.{0}".format(column) for column in TWEET_COLUMNS))
+    )
+
+    op.create_table(
+        'post_sentiment_scores',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('post_id', sa.Integer, sa.ForeignKey('posts.id', name='post', ondelete='CASCADE'), nullable=False),
+        sa.Column('sentiment', sa.String(20), nullable=False),
+        sa.Column('score', sa.Float, nullable=False),
+    )
+    op.execute(
+        "INSERT INTO post_sentiment_scores (post_id, sentiment, score) "
+        "SELECT posts.id, tweet_sentiment_scores.sentiment, tweet_sentiment_scores.score FROM posts "
+        "JOIN tweet_sentiment_scores ON tweet_sentiment_scores.tweet_id = posts.tweet_id"
+    )
+
+    op.create_unique_constraint('posts_user_id_data_id', 'posts', ['user_id', 'data_id'])
+    op.drop_constraint('posts_tweet', 'posts', type_='foreignkey')
+    op.drop_constraint('posts_user_id_tweet_id', 'posts', type_='unique')
+    op.drop_index('posts_user_id_created_at', 'posts')
+    op.drop_column('posts', 'tweet_id')
+    op.execute(OLD_VIEW)
+
+    op.drop_table('tweet_sentiment_scores')
+    op.drop_table('tweets')
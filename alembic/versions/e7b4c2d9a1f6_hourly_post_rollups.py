@@ -0,0 +1,47 @@
+"""hourly post rollups
+
+Revision ID: e7b4c2d9a1f6
+Revises: c3a5e81f07d2
+Create Date: 2026-10-18 19:05:13.204417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b4c2d9a1f6'
+down_revision = 'c3a5e81f07d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'post_hourly_rollups',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('hour', sa.DateTime, nullable=False),
+        sa.Column('category_id', sa.Integer, nullable=False),
+        sa.Column('sentiment', sa.String(20), nullable=False),
+        sa.Column('country', sa.String(100), nullable=False),
+        sa.Column('state', sa.String(100), nullable=False),
+        sa.Column('city', sa.String(100), nullable=False),
+        sa.Column('post_count', sa.Integer, nullable=False),
+        sa.UniqueConstraint('user_id', 'hour', 'category_id', 'sentiment', 'country', 'state', 'city',
+                            name='post_hourly_rollups_key'),
+    )
+    # Stop the streamer while this runs, posts it completes before it restarts would be left out
+    op.execute(
+        "INSERT INTO post_hourly_rollups (user_id, hour, category_id, sentiment, country, state, city, post_count) "
+        "SELECT user_id, DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00') AS hour, category_id, "
+        "COALESCE(sentiment_score, '') AS sentiment, COALESCE(country, '') AS country, "
+        "COALESCE(state, '') AS state, COALESCE(city, '') AS city, COUNT(*) "
+        "FROM post_data_categorised_view "
+        "GROUP BY user_id, hour, category_id, sentiment, country, state, city "
+        "ON DUPLICATE KEY UPDATE post_count = post_count + VALUES(post_count)"
+    )
+
+
+def downgrade():
+    op.drop_table('post_hourly_rollups')
@@ -0,0 +1,29 @@
+"""ingest watermarks
+
+Revision ID: f2a9d63c5b10
+Revises: e7b4c2d9a1f6
+Create Date: 2026-10-18 20:11:47.530862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a9d63c5b10'
+down_revision = 'e7b4c2d9a1f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ingest_watermarks',
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('watermark', sa.DateTime, nullable=False),
+        sa.Column('version', sa.BigInteger, nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('ingest_watermarks')
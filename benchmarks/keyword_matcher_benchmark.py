@@ -0,0 +1,80 @@
+"""
+Compares the cost of categorising a post as a tenant's keyword list grows.
+
+    python -m benchmarks.keyword_matcher_benchmark
+
+The naive matcher is the old per-keyword substring loop; the automaton should stay flat
+while the naive cost grows with the number of keywords.
+"""
+import random
+import string
+import time
+
+from services.keyword_matcher import KeywordMatcher, parse_keywords
+
+USER_ID = 1
+KEYWORDS_PER_CATEGORY = 20
+POSTS = 500
+
+
+def random_word(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(6, 10)))
+
+
+def build_keyword_rows(rng, keyword_count):
+    rows = []
+    for category_id in range(keyword_count // KEYWORDS_PER_CATEGORY):
+        keywords = ",".join(random_word(rng) for _ in range(KEYWORDS_PER_CATEGORY))
+        rows.append((USER_ID, category_id, keywords))
+    return rows
+
+
+def build_posts(rng, keyword_rows):
+    vocabulary = [keyword for _, _, keywords in keyword_rows for keyword in parse_keywords(keywords)]
+    posts = []
+    for _ in range(POSTS):
+        words = [random_word(rng) for _ in range(25)] + rng.sample(vocabulary, 2)
+        rng.shuffle(words)
+        posts.append(" ".join(words))
+    return posts
+
+
+def naive_match(keyword_rows, text):
+    category_ids = set()
+    for _, category_id, keywords in keyword_rows:
+        for keyword in keywords.split(","):
+            if keyword.lower().strip() in text.lower():
+                category_ids.add(category_id)
+                break
+    return category_ids
+
+
+def time_per_post(match, posts):
+    start = time.perf_counter()
+    for post in posts:
+        match(post)
+    return (time.perf_counter() - start) / len(posts) * 1000000
+
+
+def main():
+    rng = random.Random(42)
+    print("{:>10} {:>16} {:>16} {:>12}".format("keywords", "naive us/post", "automaton us/post", "build ms"))
+
+    for keyword_count in (100, 1000, 5000, 20000):
+        keyword_rows = build_keyword_rows(rng, keyword_count)
+        posts = build_posts(rng, keyword_rows)
+
+        start = time.perf_counter()
+        matcher = KeywordMatcher.from_keyword_rows(keyword_rows)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        for post in posts[:50]:
+            assert matcher.match(USER_ID, post) == naive_match(keyword_rows, post)
+
+        naive = time_per_post(lambda text: naive_match(keyword_rows, text), posts)
+        automaton = time_per_post(lambda text: matcher.match(USER_ID, text), posts)
+        print("{:>10} {:>16.1f} {:>17.1f} {:>12.1f}".format(keyword_count, naive, automaton, build_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -30,6 +30,7 @@ def create_category(db: Session, category_name: str, group_category_id: int, key
         keywords=keywords
     )
     db.add(db_keywords)
+    record_keyword_change(db, db_category.id)
     db.commit()
     db.refresh(db_keywords)
     return db_category
@@ -65,12 +66,15 @@ def update_category(db: Session, category_id: str, category_name: str, group_cat
         db.query(schema.Keyword) \
             .filter(schema.Keyword.category_id == category_id) \
             .update({"keywords": keywords})
+    record_keyword_change(db, category_id)
     db.commit()
     return result
 
 
 # Delete a particular category
 def delete_category(db: Session, category_id: int):
+    record_keyword_change(db, category_id)
+    delete_category_rollups(db, [category_id])
     result = db.query(schema.Category) \
         .filter(schema.Category.id == category_id) \
         .delete()
@@ -78,6 +82,24 @@ def delete_category(db: Session, category_id: int):
     return result
 
 
+# Log that a category's keywords changed so the streamer recompiles them (committed by the caller)
+def record_keyword_change(db: Session, category_id: int):
+    group_category = db.query(schema.GroupCategory) \
+        .join(schema.Category) \
+        .filter(schema.Category.id == category_id) \
+        .first()
+    if group_category is not None:
+        db.add(schema.KeywordChange(user_id=group_category.user_id, category_id=category_id))
+
+
+# The charts count from the hourly rollups, drop a deleted category's counts with it (committed by the caller)
+def delete_category_rollups(db: Session, category_ids):
+    if category_ids:
+        db.query(schema.PostHourlyRollup) \
+            .filter(schema.PostHourlyRollup.category_id.in_(category_ids)) \
+            .delete(synchronize_session=False)
+
+
 # get posts regarding the specified category
 def get_category_posts(category_id: int, db: Session):
     # why doesn't this work
@@ -113,22 +135,23 @@ def get_category_posts(category_id: int, db: Session):
     # col_concat = functions.concat("https://www.twitter.com/", # schema.Post.data_user_name).label("link")
     # col_concat = func.concat("https://www.twitter.com/", schema.Post.data_user_name)
     sth = db.query(schema.Post.id,
-                   schema.Post.data_user_name,
-                   schema.Post.source_name,
-                   schema.Post.state_name,
-                   schema.Post.data_author_id,
-                   schema.Post.data_user_location,
-                   schema.Post.country_name,
-                   schema.Post.text,
-                   schema.Post.city_name,
+                   schema.Tweet.data_user_name,
+                   schema.Tweet.source_name,
+                   schema.Tweet.state_name,
+                   schema.Tweet.data_author_id,
+                   schema.Tweet.data_user_location,
+                   schema.Tweet.country_name,
+                   schema.Tweet.text,
+                   schema.Tweet.city_name,
                    schema.Post.created_at,
-                   schema.Post.link,
+                   schema.Tweet.link,
                    schema.PostAboutCategory.category_id,
-                   schema.PostSentimentScore.sentiment) \
+                   schema.TweetSentimentScore.sentiment) \
         .join(schema.PostAboutCategory) \
         .filter(schema.PostAboutCategory.category_id == category_id) \
-        .join(schema.PostSentimentScore) \
-        .filter(schema.PostSentimentScore.sentiment != "NEUTRAL") \
+        .join(schema.Tweet, schema.Post.tweet_id == schema.Tweet.id) \
+        .join(schema.TweetSentimentScore, schema.TweetSentimentScore.tweet_id == schema.Tweet.id) \
+        .filter(schema.TweetSentimentScore.sentiment != "NEUTRAL") \
         .order_by(schema.Post.created_at.desc()) \
         .limit(50) \
         .all()
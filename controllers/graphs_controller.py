@@ -1,22 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 # Custom
 import stop_words_custom
 from auth import auth
 from core.models.database import engine
+from services.post_rollups import chart_rows, CHART_SOURCES, POST_COUNT
+from services.chart_cache import ChartCache
+from services.ingest_watermarks import IngestWatermarks
+from services.pipeline_stats import PipelineStats, serve_metrics
+import os
 import re
 import statistics
 
 import stop_words
 
 view_in_use = 'post_data_categorised_view'
+# Counting charts read whole hours from post_hourly_rollups, see post_rollups.chart_rows
+
+# Every graph statement is built once at import with bound parameters, so their compiled form can be reused
+graph_engine = engine.execution_options(compiled_cache={})
+
+graph_stats = PipelineStats(prefix="graphs_")
+if os.getenv('GRAPH_METRICS_PORT'):
+    serve_metrics(graph_stats, int(os.getenv('GRAPH_METRICS_PORT')), os.getenv('GRAPH_METRICS_HOST', '127.0.0.1'))
+
+# Chart results per (chart, user, range, granularity), recomputed when the streamer adds to a range still open
+chart_cache = ChartCache(IngestWatermarks(engine),
+                         max_entries=int(os.getenv('GRAPH_CACHE_SIZE', 1000)),
+                         ttl=int(os.getenv('GRAPH_CACHE_TTL_SECONDS', 60)),
+                         lateness=int(os.getenv('GRAPH_CACHE_LATENESS_SECONDS', 600)),
+                         stats=graph_stats)
+graph_stats.gauge("chart_cache_entries", lambda: len(chart_cache.entries))
+
+# Shared by every dashboard request, so at most this many chart queries run at once however many are open
+dashboard_executor = ThreadPoolExecutor(max_workers=int(os.getenv('DASHBOARD_QUERY_WORKERS', 4)))
+
+
+# Every chart of the dashboard for one user and range, computed concurrently.
+# Each entry is what the chart's own endpoint returns
+def dashboard(user, start_date, end_date, granularity):
+    futures = {
+        "collected_conversations": dashboard_executor.submit(
+            lambda: {"charts": [daily_conversations_chart(granularity, start_date, end_date, user)]}),
+        "collected_sentiment_types": dashboard_executor.submit(
+            lambda: {"charts": [positive_negative_chart(granularity, start_date, end_date, user)]}),
+        "highlights": dashboard_executor.submit(highlights_data, start_date, end_date, user),
+        "issue_importance": dashboard_executor.submit(
+            lambda: {"charts": [issue_of_importance_chart(start_date, end_date, user)]}),
+        "issue_severity": dashboard_executor.submit(
+            lambda: {"charts": [issue_severity_chart(start_date, end_date, user)]}),
+        "map_locations": dashboard_executor.submit(locations_for_map_chart, start_date, end_date, user),
+        "word_cloud_tweets": dashboard_executor.submit(word_cloud_tweets, start_date, end_date, user),
+        "word_cloud_locations": dashboard_executor.submit(word_cloud_locations, start_date, end_date, user),
+    }
+    return {name: future.result() for name, future in futures.items()}
 
 
 def daily_collected_conversations(db: Session, start_date: str, end_date: str, granularity: str, token: str):
     user = auth.get_user_from_token(db, token)
-    date_format, group_by_clause = get_date_granularity(granularity)
 
-    conversation_data = daily_conversations_chart(date_format, start_date, end_date, group_by_clause, user)
+    conversation_data = daily_conversations_chart(granularity, start_date, end_date, user)
 
     charts = {"charts": [conversation_data]}
 
@@ -25,16 +71,16 @@ def daily_collected_conversations(db: Session, start_date: str, end_date: str, g
 
 def positive_negative_conversations(db: Session, start_date: str, end_date: str, granularity: str, token: str):
     user = auth.get_user_from_token(db, token)
-    date_format, group_by_clause = get_date_granularity(granularity)
 
-    sentiment_data = positive_negative_chart(date_format, start_date, end_date, group_by_clause, user)
+    sentiment_data = positive_negative_chart(granularity, start_date, end_date, user)
 
     charts = {"charts": [sentiment_data]}
 
     return charts
 
 
-def positive_negative_chart(date_format, start_date, end_date, group_by_clause, user):
+@chart_cache.cached
+def positive_negative_chart(granularity, start_date, end_date, user):
     dates = []
     positive_data = {}
     negative_data = {}
@@ -43,12 +89,7 @@ def positive_negative_chart(date_format, start_date, end_date, group_by_clause,
     negative_array_data = []
     neutral_series_data = []
 
-    sql = "SELECT {} AS date, sentiment_score as 'sentiment', COUNT(post_id) as 'count' " \
-          "FROM {} " \
-          "WHERE user_id = {} AND created_at between '{}' and '{}' " \
-          "GROUP BY {}, sentiment_score".format(date_format, view_in_use, user.id, start_date, end_date, group_by_clause)
-
-    sentiment_data = engine.execute(sql)
+    sentiment_data = execute_chart(positive_negative_statements, user, start_date, end_date, granularity)
 
     for date, sentiment, count in sentiment_data:
         if date not in dates:
@@ -146,15 +187,11 @@ def get_tool_tip_format():
     }
 
 
-def daily_conversations_chart(date_format, start_date, end_date, group_by_clause, user):
+@chart_cache.cached
+def daily_conversations_chart(granularity, start_date, end_date, user):
     categories = []
     data = []
-    sql = "SELECT {} AS date, COUNT(post_id) as 'data' " \
-          "FROM {} " \
-          "WHERE user_id = {} AND created_at between '{}' and '{}' " \
-          "GROUP BY {}".format(date_format, view_in_use, user.id, start_date, end_date, group_by_clause)
-
-    conversations_data = engine.execute(sql)
+    conversations_data = execute_chart(daily_conversations_statements, user, start_date, end_date, granularity)
 
     for date, conversation_count in conversations_data:
         categories.append(date)
@@ -190,14 +227,90 @@ def get_date_granularity(granularity):
     return date_format, group_by
 
 
+GRANULARITIES = ("year", "month", "day", "week")
+
+
+# A chart's statement for each chart source (see post_rollups.CHART_SOURCES) and, for charts over time, each
+# granularity. sql is formatted with {source}, {post_count}, {date_format} and {group_by}
+def prepare_chart_statements(sql, granular=False):
+    statements = {}
+    for source_name, source in CHART_SOURCES.items():
+        for granularity in GRANULARITIES if granular else (None,):
+            date_format, group_by_clause = get_date_granularity(granularity)
+            statements[source_name, granularity] = text(sql.format(source=source, post_count=POST_COUNT,
+                                                                   date_format=date_format, group_by=group_by_clause))
+    return statements
+
+
+def execute_chart(statements, user, start_date, end_date, granularity=None):
+    source_name, params = chart_rows(user.id, start_date, end_date)
+    if granularity is not None and granularity not in GRANULARITIES:
+        # get_date_granularity treats anything else as weeks
+        granularity = "week"
+    return graph_engine.execute(statements[source_name, granularity], params)
+
+
+positive_negative_statements = prepare_chart_statements(
+    "SELECT {date_format} AS date, sentiment_score as 'sentiment', {post_count} as 'count' "
+    "FROM {source} "
+    "GROUP BY {group_by}, sentiment_score", granular=True)
+
+daily_conversations_statements = prepare_chart_statements(
+    "SELECT {date_format} AS date, {post_count} as 'data' "
+    "FROM {source} "
+    "GROUP BY {group_by}", granular=True)
+
+highlights_statements = prepare_chart_statements(
+    "SELECT sentiment_score, {post_count} as count "
+    "FROM {source} "
+    "GROUP BY sentiment_score")
+
+issue_of_importance_statements = prepare_chart_statements(
+    "SELECT categories.category_name, {post_count} as 'importance' "
+    "FROM {source} "
+    "JOIN categories ON chart_rows.category_id = categories.id "
+    "GROUP BY categories.category_name "
+    "ORDER BY importance DESC")
+
+issue_severity_statements = prepare_chart_statements(
+    "SELECT categories.category_name, {post_count} as 'importance', sentiment_score "
+    "FROM {source} "
+    "JOIN categories ON chart_rows.category_id = categories.id "
+    "GROUP BY categories.category_name, sentiment_score "
+    "ORDER BY importance DESC")
+
+# The map and word clouds need values per post, they read the view directly
+locations_for_map_statement = text(
+    "SELECT categories.category_name, city, COUNT(city) as 'count_in_city', sentiment_score "
+    "FROM {0} "
+    "JOIN categories ON {0}.category_id = categories.id "
+    "WHERE user_id = :user_id "
+    "AND created_at between :start_date AND :end_date "
+    # "AND country = 'ghana' "
+    "GROUP BY categories.category_name, city, 'count_in_city';".format(view_in_use))
+
+word_cloud_tweets_statement = text(
+    "SELECT text "
+    "FROM {} "
+    "WHERE user_id = :user_id AND created_at between :start_date and :end_date ".format(view_in_use))
+
+word_cloud_locations_statement = text(
+    "SELECT state, city "
+    "FROM {} "
+    "WHERE user_id = :user_id "
+    "AND (state <> '' or city <> '') "
+    # 'AND country = "ghana" '
+    "AND created_at BETWEEN :start_date AND :end_date ".format(view_in_use))
+
+
 def highlights(db: Session, start_date, end_date, token: str):
     user = auth.get_user_from_token(db, token)
-    sql = "SELECT sentiment_score, COUNT(post_id) as count " \
-          "FROM {} " \
-          "WHERE user_id = {} AND created_at between '{}' and '{}' " \
-          "GROUP BY sentiment_score;".format(view_in_use, user.id, start_date, end_date)
+    return highlights_data(start_date, end_date, user)
 
-    highlights_query = engine.execute(sql)
+
+@chart_cache.cached
+def highlights_data(start_date, end_date, user):
+    highlights_query = execute_chart(highlights_statements, user, start_date, end_date)
 
     sentiment_dict = {}
     for sentiment, count in highlights_query:
@@ -216,17 +329,11 @@ def issue_of_importance(db: Session, start_date: str, end_date: str, token: str)
     return charts
 
 
+@chart_cache.cached
 def issue_of_importance_chart(start_date, end_date, user):
     category_names = []
     importance = []
-    sql = "SELECT categories.category_name, COUNT(post_id) as 'importance' " \
-          "FROM {} " \
-          "JOIN categories ON {}.category_id = categories.id " \
-          "WHERE user_id = {} AND created_at between '{}' and '{}' " \
-          "GROUP BY categories.category_name " \
-          "ORDER BY importance DESC".format(view_in_use, view_in_use, user.id, start_date, end_date)
-
-    issue_data = engine.execute(sql)
+    issue_data = execute_chart(issue_of_importance_statements, user, start_date, end_date)
 
     for category_name, importance_data in issue_data:
         category_names.append(category_name)
@@ -256,6 +363,7 @@ def issue_of_severity(db: Session, start_date: str, end_date: str, token: str):
     return charts
 
 
+@chart_cache.cached
 def issue_severity_chart(start_date, end_date, user):
     categories_name = []
     positive_data = {}
@@ -265,14 +373,7 @@ def issue_severity_chart(start_date, end_date, user):
     negative_array_data = []
     neutral_series_data = []
 
-    sql = "SELECT categories.category_name, COUNT(post_id) as 'importance', sentiment_score " \
-          "FROM {} " \
-          "JOIN categories ON {}.category_id = categories.id " \
-          "WHERE user_id = {} AND created_at between '{}' and '{}' " \
-          "GROUP BY categories.category_name, sentiment_score " \
-          "ORDER BY importance DESC".format(view_in_use, view_in_use, user.id, start_date, end_date)
-
-    issue_severity_data = engine.execute(sql)
+    issue_severity_data = execute_chart(issue_severity_statements, user, start_date, end_date)
     # print(issue_severity_data)
 
     for category_name, importance, sentiment_score in issue_severity_data:
@@ -319,8 +420,11 @@ def issue_severity_chart(start_date, end_date, user):
 
 def ghana_locations_for_map(db: Session, start_date, end_date, token: str):
     user = auth.get_user_from_token(db, token)
-    # country = "AND country = 'ghana'"
-    country = ""
+    return locations_for_map_chart(start_date, end_date, user)
+
+
+@chart_cache.cached
+def locations_for_map_chart(start_date, end_date, user):
     category_names = []
     positive_data = {}
     negative_data = {}
@@ -329,16 +433,8 @@ def ghana_locations_for_map(db: Session, start_date, end_date, token: str):
     negative_array_data = []
     neutral_series_data = []
 
-    sql = "SELECT categories.category_name, city, COUNT(city) as 'count_in_city', sentiment_score " \
-          "FROM {} " \
-          "JOIN categories ON {}.category_id = categories.id " \
-          "WHERE user_id = {} " \
-          "AND created_at between '{}' " \
-          "AND '{}'" \
-          " {}" \
-          "GROUP BY categories.category_name, city, 'count_in_city';".format(view_in_use, view_in_use, user.id, start_date, end_date, country)
-    # print(sql)
-    locations = engine.execute(sql)
+    locations = graph_engine.execute(locations_for_map_statement,
+                                     user_id=user.id, start_date=start_date, end_date=end_date)
 
     for category_name, city, count_in_city, sentiment_score in locations:
         if category_name not in category_names:
@@ -384,12 +480,13 @@ def ghana_locations_for_map(db: Session, start_date, end_date, token: str):
 
 def get_word_cloud_tweets(db: Session, start_date: str, end_date: str, token: str):
     user = auth.get_user_from_token(db, token)
+    return word_cloud_tweets(start_date, end_date, user)
 
-    sql = "SELECT text " \
-          "FROM {} " \
-          "WHERE user_id = {} AND created_at between '{}' and '{}' ".format(view_in_use, user.id, start_date, end_date)
 
-    tweet_data = engine.execute(sql)
+@chart_cache.cached
+def word_cloud_tweets(start_date, end_date, user):
+    tweet_data = graph_engine.execute(word_cloud_tweets_statement,
+                                      user_id=user.id, start_date=start_date, end_date=end_date)
 
     frequencies = {}
 
@@ -442,15 +539,13 @@ def get_word_cloud_tweets(db: Session, start_date: str, end_date: str, token: st
 
 def get_word_cloud_locations(db: Session, start_date: str, end_date: str, token: str):
     user = auth.get_user_from_token(db, token)
+    return word_cloud_locations(start_date, end_date, user)
 
-    sql = "SELECT state, city " \
-          "FROM {} " \
-          "WHERE user_id = {} " \
-          "AND (state <> '' or city <> '') " \
-          "AND created_at BETWEEN '{}' AND '{}' ".format(view_in_use, user.id, start_date, end_date)
-    # 'AND country = "ghana" ' \
 
-    tweet_data = engine.execute(sql)
+@chart_cache.cached
+def word_cloud_locations(start_date, end_date, user):
+    tweet_data = graph_engine.execute(word_cloud_locations_statement,
+                                      user_id=user.id, start_date=start_date, end_date=end_date)
 
     frequencies = {}
 
@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from auth import auth
 # from core.models.database import SessionLocal
 from core.models import schema
+from controllers.category_controller import record_keyword_change, delete_category_rollups
 
 
 # Code for creating group category
@@ -52,6 +53,12 @@ def delete_group_category(db: Session, group_category_id: int, token: str):
     auth.get_user_from_token(db, token)
     group_categories = get_group_categories(db, token)
     if len(group_categories) >= min_amount:
+        categories = db.query(schema.Category) \
+            .filter(schema.Category.group_category_id == group_category_id) \
+            .all()
+        for category in categories:
+            record_keyword_change(db, category.id)
+        delete_category_rollups(db, [category.id for category in categories])
         result = db.query(schema.GroupCategory) \
             .filter(schema.GroupCategory.id == group_category_id) \
             .delete()
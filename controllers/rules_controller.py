@@ -7,13 +7,24 @@ import os
 
 # custom
 from core.models import schema
+from services.rule_planner import RulePlanner
+
+# Tag of the broad rules used when the worker attributes tweets to users itself
+BROAD_RULE_TAG = "local"
 
 
 class Rules:
     def __init__(self) -> None:
         self.max_twitter_clauses = 30
+        # How many rules the account may have live at once, adding past it is rejected
+        self.max_twitter_rules = int(os.getenv('TWITTER_MAX_RULES', 25))
+        self.rule_planner = RulePlanner(max_length=512, max_clauses=self.max_twitter_clauses)
+        # The worker matches tweets against every user's scopes, so the rules only need the union of all scopes
+        self.local_scope_attribution = os.getenv('LOCAL_SCOPE_ATTRIBUTION', 'false').lower() == 'true'
         print("rules controller initialised")
-        self.rules_uri = "https://api.twitter.com/2/tweets/search/stream/rules"
+        # Point this at fake_twitter_server.py to run without the real API
+        self.api_base_url = os.getenv('TWITTER_API_BASE_URL', "https://api.twitter.com").rstrip("/")
+        self.rules_uri = self.api_base_url + "/2/tweets/search/stream/rules"
 
     # Code for creating headers to connect to twitter for the streams
     @staticmethod
@@ -35,7 +46,11 @@ class Rules:
         if rules is None or "data" not in rules:
             return None
 
-        ids = list(map(lambda rule: rule["id"], rules["data"]))
+        self.delete_rules(headers, list(map(lambda rule: rule["id"], rules["data"])))
+
+    def delete_rules(self, headers, ids):
+        if not ids:
+            return
         payload = {"delete": {"ids": ids}}
         response = requests.post(self.rules_uri, headers=headers, json=payload)
         if response.status_code != 200:
@@ -43,44 +58,86 @@ class Rules:
                             .format(response.status_code, response.text))
         print(json.dumps(response.json()))
 
-    # Code for setting the rules needed by twitter to start the fetch
+    def add_rules(self, headers, new_rules):
+        if not new_rules:
+            return
+        payload = {"add": new_rules}
+        response = requests.post(self.rules_uri, headers=headers, json=payload)
+        if response.status_code != 201:
+            raise Exception(
+                "Cannot add rules (HTTP {}): {}".format(
+                    response.status_code, response.text)
+            )
+        print("new_rules=", json.dumps(response.json()))
+
+    # Code for setting the rules needed by twitter to start the fetch.
+    # Only the rules that differ from the live ones are added or deleted, so the stream is never left without rules
+    # unless the account is at its rule cap
     def set_rules(self):
         headers = self.create_headers(os.getenv('TWITTER_BEARER_TOKEN'))
         # get rules
-        rules = self.get_rules(headers)
-        # delete rules
-        self.delete_all_rules(headers, rules)
+        live_rules = self.get_rules(headers).get("data", [])
         with db():
             scopes = db.session.query(schema.Scope).all()
-            # Put scopes in map to group users with same scopes
-            scope_map = self.match_similar_scope_to_multiple_users_and_sanitize_map(scopes)
-            swap_scope_map = self.swap_key_values_dict(scope_map)
-            sample_rules = []
-
-            for user_ids, scopes_list in swap_scope_map.items():
-
-                scope_concat = ''
-                clauses = 0
-                for scope in scopes_list:
-                    clauses += 1
-                    if clauses > self.max_twitter_clauses - 1 or len(scope_concat + " OR " + scope) > 512:  # if addition will be > than 512
-                        if "OR" in scope_concat[:-4]:
-                            scope_concat = scope_concat[:-4]
-                        sample_rules.append({"value": scope_concat, "tag": user_ids})
-                        scope_concat = ''
-                        clauses = 0
-                    scope_concat += scope + " OR "
-
-                sample_rules.append({"value": scope_concat[:-4], "tag": user_ids})
-
-            payload = {"add": sample_rules}
-            response = requests.post(self.rules_uri, headers=headers, json=payload)
-            if response.status_code != 201:
-                raise Exception(
-                    "Cannot add rules (HTTP {}): {}".format(
-                        response.status_code, response.text)
-                )
-            print("new_rules=", json.dumps(response.json()))
+            desired_rules = self.desired_rules(scopes)
+
+        rules_to_add, rules_to_delete = self.diff_rules(desired_rules, live_rules)
+
+        for action, rules in self.order_changes(rules_to_add, rules_to_delete, len(live_rules)):
+            if action == "add":
+                self.add_rules(headers, rules)
+            else:
+                self.delete_rules(headers, [rule["id"] for rule in rules])
+
+        summary = {"kept": len(desired_rules) - len(rules_to_add), "added": len(rules_to_add),
+                   "deleted": len(rules_to_delete)}
+        print("rules {}".format(summary))
+        return summary
+
+    # Rules for the given scopes, packed into as few as the length and clause limits allow
+    def desired_rules(self, scopes):
+        # Put scopes in map to group users with same scopes
+        scope_map = self.match_similar_scope_to_multiple_users_and_sanitize_map(scopes)
+        if self.local_scope_attribution:
+            plan = self.rule_planner.plan({scope: [BROAD_RULE_TAG] for scope in scope_map})
+        else:
+            plan = self.rule_planner.plan({scope: user_ids.split(",") for scope, user_ids in scope_map.items()})
+        print("rule plan: {} rules for {} scopes, {} fewer than one set of rules per group of users".format(
+            len(plan.rules), len(scope_map), plan.rules_saved()))
+        return plan.rules
+
+    # The adds and deletes of a sync as ("add" or "delete", rules) steps in the order to make them.
+    # New rules go in before stale ones are deleted. A value can only be live once, so a rule whose tag changed
+    # is re-added after its old version is deleted. When the new rules would take the account past its rule cap,
+    # enough stale rules are deleted first to make room and the stream briefly goes without them
+    def order_changes(self, rules_to_add, rules_to_delete, live_count):
+        deleted_values = {rule["value"] for rule in rules_to_delete}
+        new_rules = [rule for rule in rules_to_add if rule["value"] not in deleted_values]
+        room = self.max_twitter_rules - live_count
+        making_room = rules_to_delete[:max(0, len(new_rules) - room)]
+        return [("delete", making_room),
+                ("add", new_rules),
+                ("delete", rules_to_delete[len(making_room):]),
+                ("add", [rule for rule in rules_to_add if rule["value"] in deleted_values])]
+
+    # Split desired rules into the ones missing from the live rules and the live rules no longer wanted,
+    # comparing by value and tag
+    @staticmethod
+    def diff_rules(desired_rules, live_rules):
+        live_by_key = {}
+        for live_rule in live_rules:
+            live_by_key.setdefault((live_rule["value"], live_rule.get("tag", "")), []).append(live_rule)
+
+        rules_to_add = []
+        for desired_rule in desired_rules:
+            matching_rules = live_by_key.get((desired_rule["value"], desired_rule["tag"]))
+            if matching_rules:
+                matching_rules.pop()
+            else:
+                rules_to_add.append(desired_rule)
+
+        rules_to_delete = [live_rule for live_rules_for_key in live_by_key.values() for live_rule in live_rules_for_key]
+        return rules_to_add, rules_to_delete
 
     @staticmethod
     def match_similar_scope_to_multiple_users_and_sanitize_map(scopes):
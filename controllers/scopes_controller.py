@@ -1,11 +1,18 @@
+import os
+
 from sqlalchemy.orm import Session
 
 from controllers import rules_controller
 from auth import auth
 from core.models import schema
+from services.rule_syncer import RuleSyncer
 
 # from rules_controller import Rules
 rules = rules_controller.Rules()
+# Scope edits only ask for a sync, bursts of them are coalesced into one call to the rules API
+rule_syncer = RuleSyncer(rules.set_rules,
+                         debounce=float(os.getenv('RULE_SYNC_DEBOUNCE_SECONDS', 2)),
+                         max_delay=float(os.getenv('RULE_SYNC_MAX_DELAY_SECONDS', 10)))
 
 
 # Code for creating group category
@@ -18,7 +25,7 @@ def create_scope(db: Session, scope: str, token: str):
     db.add(db_scope)
     db.commit()
     db.refresh(db_scope)
-    rules.set_rules()
+    db_scope.sync_job_id = rule_syncer.request()
     return db_scope
 
 
@@ -61,8 +68,8 @@ def update_scope(db: Session, scope_id: int, scope: str):
         .filter(schema.Scope.id == scope_id) \
         .update({"scope": scopes})
     db.commit()
-    rules.set_rules()
-    return result
+    # No sync when no scope was changed, the job id is then None
+    return result, rule_syncer.request() if result else None
 
 
 # Delete a scope
@@ -72,5 +79,9 @@ def delete_scope(db: Session, scope_id: int):
         .filter(schema.Scope.id == scope_id) \
         .delete()
     db.commit()
-    rules.set_rules()
-    return result
+    return result, rule_syncer.request() if result else None
+
+
+# Status of a rule sync requested by a scope change
+def get_rule_sync(job_id: str):
+    return rule_syncer.status(job_id)
@@ -14,8 +14,21 @@ import socket
 # Import os and dotenv to read data from env file
 import os
 from dotenv import load_dotenv
-from services.sentiment_service import SentimentService
+from services.sentiment_service import SentimentEngine
+from services.batching import drain_batch
+from services.keyword_index import KeywordIndex
+from services.scope_index import ScopeIndex
+from services.gazetteer import Gazetteer
+from services.pipeline_stats import PipelineStats, serve_metrics
+from services.spool import SegmentLog, OffsetTracker
+from services.stream_supervisor import StreamSupervisor, NETWORK, DISCONNECT
+from services.post_deduplicator import PostDeduplicator, unfinished_stages
+from services.payload_codec import PayloadCodec, load_codec
+from services.stage_records import TweetRecord, PostRecord
+from services.post_rollups import rollup_posts, rollup_tweets
+from services.ingest_watermarks import advance_watermarks
 from core.models.database import engine
+from sqlalchemy import and_, select
 
 # custom
 from core.models import schema
@@ -25,7 +38,10 @@ from queue import Queue
 import threading
 
 import time
+import calendar
+import atexit
 from builtins import any as b_any
+from collections import Counter
 
 load_dotenv()
 
@@ -46,19 +62,72 @@ def ping_backend():
 # MyTwitter is inheriting from the parent class 'Rules' found in rules controller
 class MyTwitter(Rules):
 
-    def __init__(self) -> None:
+    # live=False sets up the pipeline without touching the Twitter API, e.g. to replay a recorded stream.
+    # threaded=False leaves the stage threads unstarted for a runtime that drives the stages itself
+    def __init__(self, live=True, threaded=True) -> None:
         super().__init__()
-        self.request_wait_time = 180
+        self.stats = PipelineStats()
+        # New tweets not scored yet, with their categorised posts waiting on the score
+        # before they show up in post_data_categorised_view
+        self.visibility_lock = threading.Lock()
+        self.awaiting_score = {}
+        # Posts handed to the categorise stage and not finished yet, so a redelivery does not categorise them twice
+        self.categorizing = set()
+        # Categorise and score commits take turns, so whichever completes a post sees the other's rows
+        # and adds it to the hourly rollups exactly once
+        self.rollup_lock = threading.Lock()
+        # When set, every line received from the stream is also appended to this file for replaying later
+        stream_record_path = os.getenv('STREAM_RECORD_PATH')
+        self.stream_record_file = open(stream_record_path, "ab") if stream_record_path else None
+        # When set, received lines go through an on-disk log first so a restart resumes where processing stopped
+        spool_dir = os.getenv('SPOOL_DIR')
+        # Only the stage threads read the spool, a runtime driving the stages itself would leave it unread
+        if spool_dir and not threaded:
+            raise Exception("SPOOL_DIR={} is only supported by the threaded runtime, unset it to run without "
+                            "the spool".format(spool_dir))
+        self.spool = SegmentLog(spool_dir, fsync_every=int(os.getenv('SPOOL_FSYNC_EVERY', 100)),
+                                fsync_interval=int(os.getenv('SPOOL_FSYNC_MS', 200)) / 1000) if spool_dir else None
+        self.offset_tracker = OffsetTracker(self.spool, "pipeline") if self.spool else None
+        # Reconnect backoff and stall detection for the stream connection
+        self.stream_supervisor = StreamSupervisor(self.stats, stall_timeout=int(os.getenv('STREAM_STALL_SECONDS', 30)))
+        # Posts are written in batches of up to this many rows, or whatever arrived within the wait time
+        self.insert_batch_size = int(os.getenv('POST_INSERT_BATCH_SIZE', 500))
+        self.insert_batch_wait = int(os.getenv('POST_INSERT_BATCH_WAIT_MS', 250)) / 1000
+        # A batch that cannot be stored is retried with a doubling delay, then set aside in a file
+        # that replay_streamer.py can feed back in once whatever was wrong is fixed
+        self.store_attempts = int(os.getenv('STORE_ATTEMPTS', 8))
+        self.store_retry_delay = int(os.getenv('STORE_RETRY_DELAY_MS', 500)) / 1000
+        self.store_retry_max_delay = int(os.getenv('STORE_RETRY_MAX_DELAY_MS', 30000)) / 1000
+        self.failed_batch_path = os.getenv('FAILED_BATCH_PATH', 'failed_batches.jsonl')
+        self.sentiment_batch_size = int(os.getenv('SENTIMENT_BATCH_SIZE', 500))
+        self.sentiment_batch_wait = int(os.getenv('SENTIMENT_BATCH_WAIT_MS', 250)) / 1000
+        self.categorize_batch_size = int(os.getenv('CATEGORIZE_BATCH_SIZE', 500))
+        self.categorize_batch_wait = int(os.getenv('CATEGORIZE_BATCH_WAIT_MS', 250)) / 1000
+        # Score and categorise in the store stage and write everything for a batch in one transaction
+        self.fused_pipeline = os.getenv('FUSED_PIPELINE', 'false').lower() == 'true'
+        self.keyword_refresh_interval = int(os.getenv('KEYWORD_REFRESH_SECONDS', 30))
+        self.keyword_index = KeywordIndex()
+        # Only used with LOCAL_SCOPE_ATTRIBUTION, see Rules
+        self.scope_refresh_interval = int(os.getenv('SCOPE_REFRESH_SECONDS', 30))
+        self.scope_index = ScopeIndex()
+        self.gazetteer = Gazetteer([], [], [], {})
+        # Remembers recently stored (user_id, data_id) pairs so reconnect redeliveries are dropped before insert
+        self.deduplicator = PostDeduplicator(int(os.getenv('DEDUP_FILTER_CAPACITY', 2000000)),
+                                             float(os.getenv('DEDUP_FILTER_ERROR_RATE', 0.001)))
+        self.payload_codec = PayloadCodec()
         try:
+            self.keyword_index.load()
+            if self.local_scope_attribution:
+                self.scope_index.refresh()
+            self.deduplicator.load_recent(int(os.getenv('DEDUP_FILTER_DAYS', 3)))
+            with engine.connect() as connection:
+                self.payload_codec = load_codec(connection)
+
             with db():
-                self.keywords = db.session.query(schema.Keyword, schema.Category, schema.GroupCategory) \
-                    .join(schema.Category, schema.Keyword.category_id == schema.Category.id) \
-                    .join(schema.GroupCategory, schema.GroupCategory.id == schema.Category.group_category_id).all()
-
-                self.countries = [country_tuple.country_name.lower() for country_tuple in
-                                  db.session.query(schema.Country).all()]
-                self.states = [state_tuple.state_name.lower() for state_tuple in db.session.query(schema.State).all()]
-                self.cities = [state_tuple.city_name.lower() for state_tuple in db.session.query(schema.City).all()]
+                self.gazetteer = Gazetteer.load_or_build(os.getenv('GAZETTEER_PATH'), db.session)
+                self.countries = self.gazetteer.countries
+                self.states = self.gazetteer.states
+                self.cities = self.gazetteer.cities
                 # comment below out after script run for
 
                 # not needed # self.cities = [cities_tuple.state_name.lower() for cities_tuple in db.session.query(schema.City).all()]
@@ -71,69 +140,85 @@ class MyTwitter(Rules):
             # print("NOT saved")
             print(e)
 
+        # Start the scoring workers before any threads exist in this process
+        self.sentiment_engine = SentimentEngine()
+
         # Start queues for streams and sentiment scores
         self.stream_queue = Queue()
         self.sentiment_queue = Queue()
         self.categorize_post_queue = Queue()
+        self.stats.gauge("queue_depth", self.stream_queue.qsize, queue="stream")
+        self.stats.gauge("queue_depth", self.sentiment_queue.qsize, queue="sentiment")
+        self.stats.gauge("queue_depth", self.categorize_post_queue.qsize, queue="categorize")
+        if os.getenv('METRICS_PORT'):
+            serve_metrics(self.stats, int(os.getenv('METRICS_PORT')), os.getenv('METRICS_HOST', '127.0.0.1'))
 
         # Threads so functions can be running in background asynchronously
-        threading.Thread(target=self.store_streams, daemon=True).start()
-        threading.Thread(target=self.score_sentiment, daemon=True).start()
-        threading.Thread(target=self.check_post_is_about_category, daemon=True).start()
+        if threaded:
+            if self.spool is not None:
+                threading.Thread(target=self.read_spool, daemon=True).start()
+                threading.Thread(target=self.offset_tracker.watch, args=(self.offset_tracker.commit_interval,),
+                                 daemon=True).start()
+                atexit.register(self.offset_tracker.flush)
+            threading.Thread(target=self.store_streams, daemon=True).start()
+            threading.Thread(target=self.score_sentiment, daemon=True).start()
+            threading.Thread(target=self.check_post_is_about_category, daemon=True).start()
+        threading.Thread(target=self.keyword_index.watch, args=(self.keyword_refresh_interval,), daemon=True).start()
+        if self.local_scope_attribution:
+            threading.Thread(target=self.scope_index.watch, args=(self.scope_refresh_interval,), daemon=True).start()
         # threading.Thread(target=self.ping_backend, daemon=True).start()
 
+        if not live:
+            return
+
         # create headers
         headers = self.create_headers(os.getenv('TWITTER_BEARER_TOKEN'))
-        # get rules
-        rules = self.get_rules(headers)
-        # delete rules
-        self.delete_all_rules(headers, rules)
-        # set rules is being called from the rules controller
-        self.set_rules()
+        self.reset_rules(headers)
         # start stream
         self.get_stream(headers)
 
+    def reset_rules(self, headers):
+        # set rules is being called from the rules controller, it only changes the rules that differ
+        self.set_rules()
+
     def check_post_is_about_category(self):
         while True:
-            post_to_categorize = self.categorize_post_queue.get()
-            # print(f"Tagging {post_to_categorize.text}")
-
-            for keyword_record in self.keywords:
-
-                if keyword_record.GroupCategory.user_id == post_to_categorize.user_id:
-                    # print(keyword_record.Keyword.keywords)
-                    if not keyword_record.Keyword.keywords:
-                        break
-                    keyword_list = keyword_record.Keyword.keywords.split(",")
-                    for keyword in keyword_list:
-                        keyword = str.encode(keyword)
-                        # print(type(keyword))
-                        # keyword = keyword.decode(encoding="UTF-8")
-                        # print(keyword)
-                        # print(keyword != b'')
-                        # print(post_to_categorize.text.lower())
-                        # keyword = keyword.encode("ascii")
-                        # print(keyword, post_to_categorize.text.lower())  #
-                        if keyword != b'' and keyword.lower().strip() in post_to_categorize.text.lower():
-                            db_categorization = schema.PostAboutCategory(
-                                post_id=post_to_categorize.id,
-                                category_id=keyword_record.Keyword.category_id
-                            )
-                            # print('categorized', keyword, post_to_categorize.id)
-                            try:
-                                with db():
-                                    db.session.add(db_categorization)
-                                    db.session.commit()
-                                    db.session.refresh(db_categorization)
-                            except Exception as e:
-                                print("Could not categorize post")
-                                print(e)
-                            break
-            # print(f"Finished attempt to categorize {post_to_categorize.text}")
+            self.categorize_posts(
+                drain_batch(self.categorize_post_queue, self.categorize_batch_size, self.categorize_batch_wait))
+
+    def categorize_posts(self, posts_to_categorize):
+        posts_to_categorize = [post for post in posts_to_categorize if post]
+
+        start = time.perf_counter()
+        categorization_rows = []
+        categorised_posts = []
+        for post_to_categorize in posts_to_categorize:
+            # One pass over the text finds every category of the post's user it is about
+            category_ids = self.keyword_index.match(post_to_categorize.user_id, post_to_categorize.text)
+            for category_id in category_ids:
+                categorization_rows.append(dict(post_id=post_to_categorize.id, category_id=category_id))
+            if category_ids:
+                categorised_posts.append(post_to_categorize)
+
+        try:
+            if categorization_rows:
+                with self.rollup_lock, engine.begin() as connection:
+                    connection.execute(schema.PostAboutCategory.__table__.insert(), categorization_rows)
+                    rollup_posts(connection, [post.id for post in categorised_posts])
+            self.posts_categorised(categorised_posts)
+            self.acknowledge_posts(posts_to_categorize)
+        except Exception as e:
+            # Unacknowledged, so their spool records are replayed after a restart and,
+            # found stored but not categorised, categorised again
+            print("Could not categorize batch of {} posts".format(len(posts_to_categorize)))
+            print(e)
+            self.stats.increment("categorize_failures", len(posts_to_categorize))
+        with self.visibility_lock:
+            self.categorizing.difference_update(post.id for post in posts_to_categorize)
+        self.stats.record("categorize", time.perf_counter() - start, len(posts_to_categorize))
 
     # Code for generating bearer token
-    @staticmethod
-    def generate_bearer_token():
+    def generate_bearer_token(self):
         bearer_token = base64.b64encode(
             f"{os.getenv('TWITTER_CLIENT_ID')}:{os.getenv('TWITTER_CLIENT_SECRET')}".encode())
         headers = {
@@ -141,7 +226,7 @@ class MyTwitter(Rules):
             "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8",
         }
         resp = requests.post(
-            url="https://api.twitter.com/oauth2/token",
+            url=self.api_base_url + "/oauth2/token",
             data={"grant_type": "client_credentials"},
             headers=headers,
         )
@@ -149,162 +234,492 @@ class MyTwitter(Rules):
 
         return data
 
-    # Start getting tweets that contain the rules specified
+    def stream_url(self):
+        base_url = self.api_base_url + "/2/tweets/search/stream?"
+        # tweet_fields = "tweet.fields=author_id,created_at,entities,id,lang,possibly_sensitive,public_metrics,referenced_tweets,reply_settings,source,text,withheld"
+        tweet_fields = "tweet.fields=created_at,id,lang,source,referenced_tweets"
+        # place_fields = "&place.fields=contained_within,country,country_code,full_name,geo,id,name,place_type"
+        # referenced_tweets.id puts the retweeted tweet, whose text is not truncated, in includes.tweets
+        expansions = "&expansions=author_id,referenced_tweets.id"
+        user_fields = "&user.fields=name,username,location"
+
+        # "tweet.fields=created_at & expansions = author_id & user.fields = created_at"
+
+        return base_url + tweet_fields + user_fields + expansions  # + place_fields
+
+    # Start getting tweets that contain the rules specified, reconnecting as the supervisor says when it drops
     def get_stream(self, headers):  # , token:str set, bearer_token,
         print("getting streams method")
-        count = 1
+        supervisor = self.stream_supervisor
         while True:
-            base_url = "https://api.twitter.com/2/tweets/search/stream?"
-            # tweet_fields = "tweet.fields=author_id,created_at,entities,id,lang,possibly_sensitive,public_metrics,referenced_tweets,reply_settings,source,text,withheld"
-            tweet_fields = "tweet.fields=created_at,id,lang,source"
-            # place_fields = "&place.fields=contained_within,country,country_code,full_name,geo,id,name,place_type"
-            expansions = "&expansions=author_id"
-            user_fields = "&user.fields=name,username,location"
-
-            # "tweet.fields=created_at & expansions = author_id & user.fields = created_at"
+            url = self.stream_url()
+            try:
+                # The read timeout is the stall window: a healthy stream sends at least a keep-alive newline
+                response = requests.get(url, headers=headers, stream=True, timeout=(10, supervisor.stall_timeout))
+                print(response)
+            except requests.exceptions.RequestException as e:
+                print(e)
+                time.sleep(supervisor.failed(NETWORK))
+                continue
 
-            url = base_url + tweet_fields + user_fields + expansions  # + place_fields
-            # print(url)
+            if response.status_code != 200:
+                print(response.text)
+                time.sleep(supervisor.failed(supervisor.classify_status(response.status_code),
+                                             supervisor.retry_after(response.headers)))
+                continue
 
-            response = requests.get(url, headers=headers, stream=True)
-            print(response)
+            supervisor.connected()
             try:
                 for response_line in response.iter_lines():
+                    supervisor.activity()
                     if response_line:
-                        json_response = json.loads(response_line)
-                        # print(json_response)
-                        self.stream_queue.put(json_response)
-                        count = 1
-            except Exception as r:
-                # if response.status_code == 429:
-                print(' Put to sleep before retrying.')
-                time_count = self.request_wait_time * count
-                time.sleep(time_count)
-                count += 1
-                # print(r)
-                print("Printed after " + str(time_count) + " seconds.")
-                print(r)
-                continue
-                # else:
-                #     print(' Put to sleep before retrying.')
-                #     time.sleep(5)
-                #     print("Printed after 5 seconds.")
+                        self.receive_stream_line(response_line)
+                kind = DISCONNECT
+            except Exception as e:
+                print(e)
+                kind = supervisor.read_failure()
+            finally:
+                response.close()
+            time.sleep(supervisor.failed(kind))
 
     def score_sentiment(self):
         print("score sentiment method")
         while True:
-            post_to_score = self.sentiment_queue.get()
-            if post_to_score:
-                # print(f"Scoring {post_to_score.id}")
-                result = SentimentService().get_sentiment(str(post_to_score.text))
-
-                db_sentiment = schema.PostSentimentScore(
-                    post_id=post_to_score.id,
-                    sentiment=result["sentiment"],
-                    score=result["score"]
-                )
-                try:
-                    with db():
-                        db.session.add(db_sentiment)
-                        db.session.commit()
-                        db.session.refresh(db_sentiment)
-                except Exception as e:
-                    # print("NOT saved")
-                    print(e)
-                # print(f"Scored {post_to_score.id}")
+            self.score_tweets(drain_batch(self.sentiment_queue, self.sentiment_batch_size, self.sentiment_batch_wait))
+
+    # A tweet is scored once, every user it was collected for shares the score
+    def score_tweets(self, tweets_to_score):
+        tweets_to_score = [tweet for tweet in tweets_to_score if tweet]
+        if not tweets_to_score:
+            return
+        start = time.perf_counter()
+        try:
+            results = self.sentiment_engine.get_sentiments([str(tweet.text) for tweet in tweets_to_score])
+
+            sentiment_rows = [dict(tweet_id=tweet_to_score.id, sentiment=result["sentiment"], score=result["score"])
+                              for tweet_to_score, result in zip(tweets_to_score, results)]
+            with self.rollup_lock, engine.begin() as connection:
+                connection.execute(schema.TweetSentimentScore.__table__.insert(), sentiment_rows)
+                rollup_tweets(connection, [tweet.id for tweet in tweets_to_score])
+            self.tweets_scored(tweets_to_score)
+            self.acknowledge_posts(tweets_to_score)
+        except Exception as e:
+            # Unacknowledged, so their spool records are replayed after a restart and,
+            # found stored but not scored, scored again
+            print("Could not score batch of {} tweets".format(len(tweets_to_score)))
+            print(e)
+            self.stats.increment("score_failures", len(tweets_to_score))
+            self.tweets_scored(tweets_to_score, visible=False)
+        self.stats.record("score", time.perf_counter() - start, len(tweets_to_score))
 
     def store_streams(self):
         print("store streams method")
         while True:
-            stream_results = self.stream_queue.get()
-            if stream_results:
-                user_location = ""
-                country_name, state_name, city_name = '', "", ''
-                if "includes" in stream_results:
-                    if "location" in stream_results["includes"]["users"][0]:
-                        user_location = stream_results["includes"]["users"][0]["location"]
-
-                        # Todo: location can be done better. This only looks out for Gh location
-                        try:
-                            country_name, state_name, city_name = self.get_locations(user_location)
-                        except Exception as e:
-                            print(e)
-                            pass
-
-                # Split user ids that are returned from twitter
-                user_ids = stream_results['matching_rules'][0]["tag"].split(",")
+            # Take whatever has queued up (bounded by size and time) and write it in one go
+            new_tweets, stored_posts = self.store_stream_batch(
+                drain_batch(self.stream_queue, self.insert_batch_size, self.insert_batch_wait))
+
+            for new_tweet in new_tweets:
+                self.sentiment_queue.put(new_tweet)
+            for db_stream in stored_posts:
+                self.categorize_post_queue.put(db_stream)
+
+    # Returns the new tweets still to be scored and the stored posts still to be categorised
+    def store_stream_batch(self, stream_batch):
+        start = time.perf_counter()
+        stored = True
+        delay = self.store_retry_delay
+        for attempt in range(1, self.store_attempts + 1):
+            try:
+                if self.fused_pipeline:
+                    new_tweets, stored_posts = self.store_processed_posts(stream_batch)
+                else:
+                    new_tweets, stored_posts = self.store_posts(stream_batch)
+                break
+            except Exception as e:
+                print("Could not store batch of {} streams (attempt {} of {})".format(
+                    len(stream_batch), attempt, self.store_attempts))
+                print(e)
+                self.stats.increment("store_failures", len(stream_batch))
+                if attempt < self.store_attempts:
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.store_retry_max_delay)
+        else:
+            new_tweets, stored_posts = [], []
+            stored = self.set_aside(stream_batch)
+        self.stats.record("store", time.perf_counter() - start, len(stream_batch))
+        self.stats.increment("tweets_stored", len(new_tweets))
+        self.stats.increment("posts_stored", len(stored_posts))
+
+        # A batch that was neither written nor set aside stays outstanding, so the spool keeps it
+        # and replays it after a restart
+        if self.offset_tracker is not None and stored:
+            # Each new tweet still has to be scored and each post categorised before its spool record is done
+            pending_per_offset = Counter(record.spool_offset for record in new_tweets + stored_posts)
+            for offset, _ in stream_batch:
+                if offset is not None:
+                    self.offset_tracker.expect(offset, 0 if self.fused_pipeline else pending_per_offset[offset])
+        if self.fused_pipeline:
+            return [], []
+        with self.visibility_lock:
+            for new_tweet in new_tweets:
+                self.awaiting_score.setdefault(new_tweet.id, [])
+            self.categorizing.update(post.id for post in stored_posts)
+        return new_tweets, stored_posts
+
+    # Append a batch that could not be stored to the failed batch file, in the format STREAM_RECORD_PATH uses.
+    # Returns whether it was written
+    def set_aside(self, stream_batch):
+        try:
+            with open(self.failed_batch_path, "ab") as failed_batch_file:
+                for _, response_line in stream_batch:
+                    if response_line:
+                        failed_batch_file.write(response_line + b"\n")
+                failed_batch_file.flush()
+                os.fsync(failed_batch_file.fileno())
+        except OSError as e:
+            print("Could not set aside batch of {} streams in {}".format(len(stream_batch), self.failed_batch_path))
+            print(e)
+            return False
+        print("Set aside batch of {} streams in {}".format(len(stream_batch), self.failed_batch_path))
+        self.stats.increment("store_batches_set_aside")
+        return True
+
+    # A tweet dropped on its way to scoring is never scored, so nothing waits for it
+    def tweet_dropped(self, tweet):
+        self.tweets_scored([tweet], visible=False)
+
+    def post_dropped(self, post):
+        with self.visibility_lock:
+            self.categorizing.discard(post.id)
+
+    # Categorised posts are visible once their tweet has a score too
+    def posts_categorised(self, posts):
+        visible = []
+        with self.visibility_lock:
+            for post in posts:
+                waiting = self.awaiting_score.get(post.tweet_id)
+                if waiting is None:
+                    visible.append(post)
+                else:
+                    waiting.append(post)
+        self.record_visible(visible)
+
+    def tweets_scored(self, tweets, visible=True):
+        posts = []
+        with self.visibility_lock:
+            for tweet in tweets:
+                posts.extend(self.awaiting_score.pop(tweet.id, []))
+        if visible:
+            self.record_visible(posts)
+
+    # Observe the end to end lag from the tweet being posted to it showing up in the charts,
+    # and move the users' ingest watermarks on so cached charts of theirs are recomputed
+    def record_visible(self, posts):
+        posts = list(posts)
+        if not posts:
+            return
+        now = time.time()
+        for post in posts:
+            posted = calendar.timegm(time.strptime(str(post.created_at), "%Y-%m-%d %H:%M:%S"))
+            self.stats.observe("visible_lag_seconds", max(0.0, now - posted))
+        try:
+            with engine.begin() as connection:
+                advance_watermarks(connection, [(post.user_id, post.created_at) for post in posts])
+        except Exception as e:
+            print("Could not advance the ingest watermarks")
+            print(e)
+
+    # Turn one tweet from the stream into a tweet row and the ids of the users in its rule tag
+    def build_tweet_row(self, stream_results, response_line):
+        user_location = ""
+        country_name, state_name, city_name = '', "", ''
+        if "includes" in stream_results:
+            if "location" in stream_results["includes"]["users"][0]:
+                user_location = stream_results["includes"]["users"][0]["location"]
+
+                # Todo: location can be done better. This only looks out for Gh location
+                start = time.perf_counter()
+                try:
+                    country_name, state_name, city_name = self.get_locations(user_location)
+                except Exception as e:
+                    print(e)
+                    pass
+                self.stats.observe("location_seconds", time.perf_counter() - start)
+
+        tweet_row = dict(
+            source_name="twitter",
+            data_id=stream_results["data"]["id"],
+            data_author_id=stream_results["data"]["author_id"],
+            data_user_name=stream_results["includes"]["users"][0]["username"],
+            data_user_location=user_location,
+
+            # Todo: location can be done better. This only looks out for Gh location
+            country_name=country_name,
+            state_name=state_name,
+            city_name=city_name,
+
+            text=stream_results["data"]["text"],
+            # Stored as received, not re-serialised
+            payload=self.payload_codec.compress(response_line),
+            created_at=self.to_db_format(stream_results["data"]["created_at"])
+        )
+
+        if self.local_scope_attribution:
+            # The rules are broad, work out whose scopes the tweet matches here
+            user_ids = sorted(self.scope_index.users_for(tweet_row["text"], *self.retweeted_texts(stream_results)))
+            if not user_ids:
+                self.stats.increment("tweets_unattributed")
+            return tweet_row, user_ids
+
+        # Split user ids that are returned from twitter. A scope can be spread over several rules,
+        # each tagged with some of its users, so the tweet belongs to every user of every rule it matched
+        user_ids = sorted({int(user_id) for matching_rule in stream_results['matching_rules']
+                           for user_id in matching_rule["tag"].split(",") if user_id})
+        return tweet_row, user_ids
+
+    # Full texts of the tweets a retweet retweets. The retweet's own text is cut short after its "RT @name: "
+    # prefix, and the stream matches rules against the retweeted tweet as well
+    @staticmethod
+    def retweeted_texts(stream_results):
+        retweeted_ids = {tweet["id"] for tweet in stream_results["data"].get("referenced_tweets", [])
+                         if tweet["type"] == "retweeted"}
+        if not retweeted_ids:
+            return []
+        return [tweet["text"] for tweet in stream_results.get("includes", {}).get("tweets", [])
+                if tweet["id"] in retweeted_ids]
+
+    # Tweet rows and one post row per user for a batch of received stream lines, with the spool offsets they came from
+    def build_batch_rows(self, stream_batch):
+        tweet_rows = {}
+        post_rows = []
+        decode_seconds = 0.0
+        for offset, response_line in stream_batch:
+            if response_line:
+                try:
+                    start = time.perf_counter()
+                    stream_results = json.loads(response_line)
+                    decode_seconds += time.perf_counter() - start
+                    tweet_row, user_ids = self.build_tweet_row(stream_results, response_line)
+                except Exception as e:
+                    print("Could not read stream result")
+                    print(e)
+                    self.stats.increment("decode_failures")
+                    continue
+                tweet_rows.setdefault(tweet_row["data_id"], (tweet_row, offset))
                 for user_id in user_ids:
+                    post_rows.append(dict(user_id=user_id, data_id=tweet_row["data_id"],
+                                          created_at=tweet_row["created_at"], offset=offset))
+        self.stats.record("decode", decode_seconds, len(stream_batch))
+        return tweet_rows, post_rows
+
+    # Write a batch of received stream lines with two multi-row inserts, tweets then posts,
+    # and hand back the new tweets and the stored posts (with ids) as stage records
+    def store_posts(self, stream_batch):
+        tweet_rows, post_rows = self.build_batch_rows(stream_batch)
+        if not post_rows:
+            return [], []
+
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            new_tweets, stored_posts, new_rows, redelivered_posts = self.insert_posts(connection, tweet_rows,
+                                                                                      post_rows)
+        self.stats.record("insert", time.perf_counter() - start, len(post_rows))
+        self.deduplicator.remember(new_rows)
+        unscored_tweets, uncategorised_posts = self.unfinished_records(redelivered_posts)
+        return new_tweets + unscored_tweets, stored_posts + uncategorised_posts
+
+    # Fused mode: score and categorise in memory, then write tweets, posts, scores and categories in one transaction
+    def store_processed_posts(self, stream_batch):
+        tweet_rows, post_rows = self.build_batch_rows(stream_batch)
+        if not post_rows:
+            return [], []
+
+        start = time.perf_counter()
+        texts = list({tweet_row["text"] for tweet_row, _ in tweet_rows.values()})
+        scores = dict(zip(texts, self.sentiment_engine.get_sentiments([str(text) for text in texts])))
+        self.stats.record("score", time.perf_counter() - start, len(texts))
+
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            # Scores and categories commit with their posts here, a stored post is always finished
+            new_tweets, stored_posts, new_rows, _ = self.insert_posts(connection, tweet_rows, post_rows)
+
+            categorised_posts = []
+            sentiment_rows = []
+            for new_tweet in new_tweets:
+                score = scores[new_tweet.text]
+                sentiment_rows.append(dict(tweet_id=new_tweet.id, sentiment=score["sentiment"], score=score["score"]))
+            categorization_rows = []
+            for stored_post in stored_posts:
+                category_ids = self.keyword_index.match(stored_post.user_id, stored_post.text)
+                for category_id in category_ids:
+                    categorization_rows.append(dict(post_id=stored_post.id, category_id=category_id))
+                if category_ids:
+                    categorised_posts.append(stored_post)
+
+            if sentiment_rows:
+                connection.execute(schema.TweetSentimentScore.__table__.insert(), sentiment_rows)
+            if categorization_rows:
+                connection.execute(schema.PostAboutCategory.__table__.insert(), categorization_rows)
+            # Nothing else writes scores or categories in fused mode, the batch is complete here
+            rollup_posts(connection, [stored_post.id for stored_post in categorised_posts])
+        self.stats.record("insert", time.perf_counter() - start, len(post_rows))
+        self.deduplicator.remember(new_rows)
+        # Everything in the batch is visible from the commit
+        self.record_visible(categorised_posts)
+        return new_tweets, stored_posts
+
+    # Insert the tweets not stored yet and the posts that are not duplicates.
+    # Returns the new tweets, the stored posts, the post rows that were new and the redelivered posts,
+    # which were stored before but may still need scoring or categorising
+    def insert_posts(self, connection, tweet_rows, post_rows):
+        new_indexes, stored_indexes = self.deduplicator.new_row_indexes(connection, post_rows)
+        self.stats.increment("duplicates_skipped", len(post_rows) - len(new_indexes))
+        redelivered_posts = [PostRecord(post_id, post_rows[index]["user_id"], tweet_id,
+                                        tweet_rows[post_rows[index]["data_id"]][0]["text"],
+                                        post_rows[index]["created_at"], post_rows[index]["offset"])
+                             for index, (post_id, tweet_id) in stored_indexes.items()]
+        post_rows = [post_rows[index] for index in new_indexes]
+        if not post_rows:
+            return [], [], [], redelivered_posts
+
+        tweet_rows = {data_id: tweet_rows[data_id] for data_id in {post_row["data_id"] for post_row in post_rows}}
+        new_tweets, tweets = self.insert_tweets(connection, tweet_rows)
+
+        posts_table = schema.Post.__table__
+        # IGNORE also skips rows it cannot store, only post what made it into tweets
+        post_rows = [post_row for post_row in post_rows if post_row["data_id"] in tweets]
+        insert_rows = [dict(user_id=post_row["user_id"], tweet_id=tweets[post_row["data_id"]].id,
+                            created_at=post_row["created_at"])
+                       for post_row in post_rows]
+        if not insert_rows:
+            return new_tweets, [], post_rows, redelivered_posts
+        # The unique key still rejects duplicates older than the filter remembers
+        result = connection.execute(posts_table.insert().prefix_with("IGNORE").values(insert_rows))
+        if not result.rowcount:
+            return new_tweets, [], post_rows, redelivered_posts
+        # MySQL reports the id of the first row of a multi-row insert that was actually written
+        first_id = result.lastrowid
+        tweet_ids = list({insert_row["tweet_id"] for insert_row in insert_rows})
+        stored_rows = connection.execute(
+            select([posts_table.c.id, posts_table.c.user_id, posts_table.c.tweet_id])
+            .where(and_(posts_table.c.id >= first_id, posts_table.c.tweet_id.in_(tweet_ids)))
+        ).fetchall()
+
+        post_ids = {(stored_row.user_id, stored_row.tweet_id): stored_row.id for stored_row in stored_rows}
+
+        stored_posts = []
+        for insert_row, post_row in zip(insert_rows, post_rows):
+            post_id = post_ids.pop((insert_row["user_id"], insert_row["tweet_id"]), None)
+            if post_id is not None:
+                # The tweet's text is carried along for the categorise stage, which matches the user's keywords against it
+                stored_posts.append(PostRecord(post_id, insert_row["user_id"], insert_row["tweet_id"],
+                                               tweets[post_row["data_id"]].text, insert_row["created_at"],
+                                               post_row["offset"]))
+        return new_tweets, stored_posts, post_rows, redelivered_posts
+
+    # Of the redelivered posts, the tweets still to be scored and the posts still to be categorised, e.g. after
+    # a crash between storing and scoring. Tweets and posts a stage is still working on are left to it: they are
+    # claimed in awaiting_score and categorizing before the db is asked, and a stage only lets go after committing
+    def unfinished_records(self, redelivered_posts):
+        if not redelivered_posts:
+            return [], []
+        tweets = {}
+        posts = []
+        with self.visibility_lock:
+            for post in redelivered_posts:
+                if post.tweet_id not in self.awaiting_score and post.tweet_id not in tweets:
+                    self.awaiting_score[post.tweet_id] = []
+                    tweets[post.tweet_id] = TweetRecord(post.tweet_id, post.text, post.spool_offset)
+                if post.id not in self.categorizing:
+                    self.categorizing.add(post.id)
+                    posts.append(post)
 
-                    date_created = self.to_db_format(stream_results["data"]["created_at"])
-
-                    db_stream = schema.Post(
-                        user_id=user_id,
-                        source_name="twitter",
-                        data_id=stream_results["data"]["id"],
-                        data_author_id=stream_results["data"]["author_id"],
-                        data_user_name=stream_results["includes"]["users"][0]["username"],
-                        data_user_location=user_location,
-
-                        # Todo: location can be done better. This only looks out for Gh location
-                        country_name=country_name,
-                        state_name=state_name,
-                        city_name=city_name,
-
-                        text=stream_results["data"]["text"],
-                        full_object=json.dumps(stream_results, indent=4, sort_keys=True),
-                        created_at=date_created
-                    )
-                    try:
-                        with db():
-                            db.session.add(db_stream)
-                            db.session.commit()
-                            db.session.refresh(db_stream)
-
-                            self.sentiment_queue.put(db_stream)
-                            self.categorize_post_queue.put(db_stream)
-                    except Exception as e:
-                        # print("NOT saved")
-                        print(e)
+        try:
+            with engine.connect() as connection:
+                unscored, uncategorised = unfinished_stages(connection, list(tweets), [post.id for post in posts])
+        except Exception:
+            self.tweets_scored(tweets.values(), visible=False)
+            with self.visibility_lock:
+                self.categorizing.difference_update(post.id for post in posts)
+            raise
+
+        # Let go of what is already done; posts categorised while a tweet was claimed become visible now
+        self.tweets_scored([tweet for tweet_id, tweet in tweets.items() if tweet_id not in unscored])
+        with self.visibility_lock:
+            self.categorizing.difference_update(post.id for post in posts if post.id not in uncategorised)
+
+        unscored_tweets = [tweet for tweet_id, tweet in tweets.items() if tweet_id in unscored]
+        uncategorised_posts = [post for post in posts if post.id in uncategorised]
+        self.stats.increment("redelivered_tweets_unscored", len(unscored_tweets))
+        self.stats.increment("redelivered_posts_uncategorised", len(uncategorised_posts))
+        return unscored_tweets, uncategorised_posts
+
+    # Insert the tweets not stored yet; returns the new ones and every one of them by data_id
+    def insert_tweets(self, connection, tweet_rows):
+        tweets_table = schema.Tweet.__table__
+        result = connection.execute(
+            tweets_table.insert().prefix_with("IGNORE").values([tweet_row for tweet_row, _ in tweet_rows.values()]))
+        first_id = result.lastrowid if result.rowcount else None
+        stored_rows = connection.execute(
+            select([tweets_table.c.id, tweets_table.c.data_id]).where(tweets_table.c.data_id.in_(list(tweet_rows)))
+        ).fetchall()
+
+        new_tweets = []
+        tweets = {}
+        for stored_row in stored_rows:
+            tweet_row, offset = tweet_rows[stored_row.data_id]
+            tweet = TweetRecord(stored_row.id, tweet_row["text"], offset)
+            tweets[stored_row.data_id] = tweet
+            # Rows written by this insert have ids from the first one on, earlier ids were already stored and scored
+            if first_id is not None and stored_row.id >= first_id:
+                new_tweets.append(tweet)
+        return new_tweets, tweets
+
+    def receive_stream_line(self, response_line):
+        self.stats.increment("stream_lines_received")
+        self.stats.increment("stream_bytes_received", len(response_line))
+        self.record_stream_line(response_line)
+        if self.spool is not None:
+            # read_spool picks it up from the log
+            self.spool.append(response_line)
+        else:
+            self.stream_queue.put((None, response_line))
+
+    # Feed the stages from the spool, starting after the last offset every stage had finished with
+    def read_spool(self):
+        print("read spool method")
+        for offset, response_line in self.spool.read_from(self.spool.committed(self.offset_tracker.consumer)):
+            self.offset_tracker.read(offset)
+            self.stream_queue.put((offset, response_line))
+
+    # Tell the spool the given posts are finished with by one stage
+    def acknowledge_posts(self, posts):
+        if self.offset_tracker is None:
+            return
+        for post in posts:
+            if post.spool_offset is not None:
+                self.offset_tracker.acknowledge(post.spool_offset)
+
+    def record_stream_line(self, response_line):
+        if self.stream_record_file is None:
+            return
+        try:
+            self.stream_record_file.write(response_line + b"\n")
+        except OSError as e:
+            print("Could not record stream line")
+            print(e)
 
     def to_db_format(self, iso_format):
         from_iso_format = datetime.datetime.fromisoformat(iso_format[:-1])
         return from_iso_format.strftime("%Y-%m-%d %H:%M:%S")
 
     def get_locations(self, location):
-        location = location.replace("-", ',')
-        location_list = location.lower().split(',')
         # for loc in location_list:
         #     if loc.strip() in ghana_states.ghana_states.lower():
         #         return 'Ghana', loc.strip(), ''
-
-        country_name = ''
-        state_name = ''
-        city_name = ''
-
-        for loc in location_list:
-            if len(loc.strip()) > 1:
-                if loc.strip() in self.countries:
-                    country_name = loc.strip()
-                elif loc.strip() in self.states:
-                    state_name = loc.strip()
-                elif loc.strip() in self.cities:
-                    city_name = loc.strip()
-
-                    if city_name is not None and city_name in 'greater accra':
-                        city_name = 'greater accra'
-
-                    if not state_name:
-                        sql = "SELECT states.state_name AS 'state', countries.country_name as 'country' " \
-                              "FROM states " \
-                              "INNER JOIN countries ON states.country_id = countries.id " \
-                              "INNER JOIN cities on cities.state_id = states.id " \
-                              "WHERE city_name = '{}'".format(city_name)
-
-                        result = engine.execute(sql).first()
-                        state_name = result[0]
-                        country_name = result[1]
-
-        return country_name, state_name, city_name
+        return self.gazetteer.resolve(location)
 
     def delete_this(self):
         country_name = ''
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Float, ForeignKey, Integer, String, TIMESTAMP, types
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Integer, LargeBinary, String, TIMESTAMP, UniqueConstraint, types
 from sqlalchemy.orm import relationship, column_property
 
 from .database import Base
@@ -70,6 +70,16 @@ class Keyword(Base):
     category = relationship("Category", back_populates="keywords")
 
 
+class KeywordChange(Base):
+    """ Append-only log of categories whose keywords changed, read by the streamer to refresh its keyword index. """
+    __tablename__ = "keyword_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
+    category_id = Column(Integer, index=True, nullable=False)
+    created_at = Column(TIMESTAMP)
+
+
 class LowerCaseText(types.TypeDecorator):
     """ Converts strings to lower case on the way in. """
     """ NOT IN USE """
@@ -114,38 +124,70 @@ class Scope(Base):
     creator = relationship("User", back_populates="scopes")
 
 
-class Post(Base):
-    __tablename__ = "posts"
+class Tweet(Base):
+    """ A tweet as received, stored once however many users collected it. """
+    __tablename__ = "tweets"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
     source_name = Column(String, index=True)
-    data_id = Column(String, index=True)
+    data_id = Column(String, unique=True, index=True)
     data_author_id = Column(String, index=True)
     data_user_name = Column(String, index=True)
     data_user_location = Column(String, index=True)
-    text = Column(String, index=True)
-    full_object = Column(String, index=True)
+    text = Column(String)
+    # The tweet exactly as received from the stream, compressed with a shared dictionary (see payload_codec)
+    payload = Column(LargeBinary)
     country_name = Column(String, index=True)
     state_name = Column(String, index=True)
     city_name = Column(String, index=True)
     created_at = Column(TIMESTAMP, index=True)
     link = column_property('https://www.' + source_name + '.com/' + data_user_name + '/status/' + data_id)
 
+    posts = relationship("Post", back_populates="tweet")
+    sentiment_score = relationship("TweetSentimentScore", back_populates="sentiment_tweet", uselist=False)
+
+    @property
+    def full_object(self):
+        # Imported here as the codec loads its dictionaries through these models
+        from services.payload_codec import decompress_payload
+        return decompress_payload(self.payload).decode() if self.payload else None
+
+
+class Post(Base):
+    """ A tweet collected for one user; categories are per user, the tweet and its score are shared. """
+    __tablename__ = "posts"
+    # Redeliveries of a tweet to the same user are ignored on insert
+    __table_args__ = (UniqueConstraint('user_id', 'tweet_id', name='posts_user_id_tweet_id'),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    tweet_id = Column(Integer, ForeignKey('tweets.id', ondelete="CASCADE"))
+    # Copied from the tweet so a user's posts can be filtered by date without the join
+    created_at = Column(TIMESTAMP, index=True)
+
     post_user = relationship("User", back_populates="posts")
-    sentiment_scores = relationship("PostSentimentScore", back_populates="sentiment_post")
+    tweet = relationship("Tweet", back_populates="posts")
     post_about_category = relationship("PostAboutCategory", back_populates="posts")
 
 
-class PostSentimentScore(Base):
-    __tablename__ = "post_sentiment_scores"
+class PayloadDictionary(Base):
+    """ Preset dictionaries for compressing tweet payloads, the newest one is used for new tweets. """
+    __tablename__ = "payload_dictionaries"
 
     id = Column(Integer, primary_key=True, index=True)
-    post_id = Column(Integer, ForeignKey('posts.id'))
+    dictionary = Column(LargeBinary)
+    created_at = Column(TIMESTAMP)
+
+
+class TweetSentimentScore(Base):
+    __tablename__ = "tweet_sentiment_scores"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tweet_id = Column(Integer, ForeignKey('tweets.id', ondelete="CASCADE"), unique=True)
     sentiment = Column(String, index=True)
     score = Column(Float, index=True)
 
-    sentiment_post = relationship("Post", back_populates="sentiment_scores")
+    sentiment_tweet = relationship("Tweet", back_populates="sentiment_score")
 
 
 class PostAboutCategory(Base):
@@ -159,6 +201,34 @@ class PostAboutCategory(Base):
     posts = relationship("Post", back_populates="post_about_category")
 
 
+class PostHourlyRollup(Base):
+    """ Rows of post_data_categorised_view counted per user, hour, category, sentiment and location (see post_rollups). """
+    __tablename__ = "post_hourly_rollups"
+    __table_args__ = (UniqueConstraint('user_id', 'hour', 'category_id', 'sentiment', 'country', 'state', 'city',
+                                       name='post_hourly_rollups_key'),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"))
+    hour = Column(TIMESTAMP)
+    category_id = Column(Integer)
+    sentiment = Column(String)
+    country = Column(String)
+    state = Column(String)
+    city = Column(String)
+    post_count = Column(Integer)
+
+
+class IngestWatermark(Base):
+    """ Advanced by the streamer as a user's posts become visible, tells the web which cached charts are stale. """
+    __tablename__ = "ingest_watermarks"
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    # Newest created_at made visible so far
+    watermark = Column(TIMESTAMP)
+    # Bumped on every batch that made any of the user's posts visible
+    version = Column(Integer)
+
+
 class PostDataCategorisedView(Base):
     __tablename__ = "post_data_categorised_view"
 
@@ -1,3 +1,6 @@
+from datetime import datetime
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -17,3 +20,19 @@ class Scope(ScopeCreate):
 
     class Config:
         orm_mode = True
+
+
+class CreatedScope(Scope):
+    sync_job_id: str
+
+    class Config:
+        orm_mode = True
+
+
+class RuleSyncJob(BaseModel):
+    id: str
+    status: str
+    requested_at: datetime
+    finished_at: Optional[datetime]
+    summary: Optional[dict]
+    error: Optional[str]
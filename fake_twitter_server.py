@@ -0,0 +1,254 @@
+# Local stand-in for the Twitter v2 filtered stream and its rules endpoint, so the ingest path can be
+# exercised and benchmarked without the real API:
+#
+#   python fake_twitter_server.py --port 8089 --rate 200 --disconnect-after 5000 --rate-limit-every 4
+#   TWITTER_API_BASE_URL=http://127.0.0.1:8089 python twitter_streamer.py
+#
+# Tweets are generated from the rules that have been set, so every tweet carries a matching rule id and tag.
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+RULES_PATH = "/2/tweets/search/stream/rules"
+STREAM_PATH = "/2/tweets/search/stream"
+TOKEN_PATH = "/oauth2/token"
+
+MAX_RULE_LENGTH = 512
+
+LOCATIONS = ["Accra, Ghana", "Kumasi", "Tamale, Northern", "Tema-Greater Accra", "London, UK", "Lagos", ""]
+WORDS = ["today", "people", "government", "price", "market", "water", "light", "school", "road", "news"]
+
+
+# Number of OR separated clauses in a rule, quoted phrases count as one
+def count_clauses(value):
+    without_phrases = re.sub(r'"[^"]*"', "phrase", value)
+    return len([clause for clause in re.split(r"\s+OR\s+", without_phrases) if clause.strip()])
+
+
+def rule_terms(rule):
+    return [term.strip().strip('"') for term in re.split(r"\s+OR\s+", rule["value"])]
+
+
+class FakeTwitter:
+    def __init__(self, options) -> None:
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.lock = threading.Lock()
+        self.rules = {}
+        self.next_rule_id = 1
+        self.next_tweet_id = 1
+        self.connections = 0
+
+    def list_rules(self):
+        with self.lock:
+            rules = list(self.rules.values())
+        meta = {"sent": self.now(), "result_count": len(rules)}
+        if not rules:
+            return {"meta": meta}
+        return {"data": rules, "meta": meta}
+
+    def change_rules(self, payload):
+        with self.lock:
+            if "delete" in payload:
+                ids = [str(rule_id) for rule_id in payload["delete"].get("ids", [])]
+                deleted = [rule_id for rule_id in ids if self.rules.pop(rule_id, None) is not None]
+                not_deleted = len(ids) - len(deleted)
+                return 200, {"meta": {"sent": self.now(),
+                                      "summary": {"deleted": len(deleted), "not_deleted": not_deleted}}}
+
+            new_rules = payload.get("add", [])
+            errors = self.validate(new_rules)
+            if errors:
+                return 400, {"errors": errors, "title": "Invalid Request", "type": "about:blank"}
+
+            created = []
+            for rule in new_rules:
+                rule_id = str(self.next_rule_id)
+                self.next_rule_id += 1
+                self.rules[rule_id] = {"id": rule_id, "value": rule["value"], "tag": rule.get("tag", "")}
+                created.append(self.rules[rule_id])
+            return 201, {"data": created,
+                         "meta": {"sent": self.now(),
+                                  "summary": {"created": len(created), "not_created": 0,
+                                              "valid": len(created), "invalid": 0}}}
+
+    def validate(self, new_rules):
+        errors = []
+        existing_values = {rule["value"] for rule in self.rules.values()}
+        if len(self.rules) + len(new_rules) > self.options.max_rules:
+            errors.append({"title": "RulesCapExceeded",
+                           "detail": "Cannot have more than {} rules".format(self.options.max_rules)})
+
+        for rule in new_rules:
+            value = rule.get("value", "")
+            if not value.strip():
+                errors.append({"title": "InvalidRule", "value": value, "detail": "Rule value is empty"})
+            elif len(value) > MAX_RULE_LENGTH:
+                errors.append({"title": "RuleTooLong", "value": value,
+                               "detail": "Rule is {} characters, the limit is {}".format(len(value), MAX_RULE_LENGTH)})
+            elif count_clauses(value) > self.options.max_clauses:
+                errors.append({"title": "TooManyClauses", "value": value,
+                               "detail": "Rule has {} clauses, the limit is {}".format(count_clauses(value),
+                                                                                       self.options.max_clauses)})
+            elif value in existing_values:
+                errors.append({"title": "DuplicateRule", "value": value, "detail": "Rule already exists"})
+            existing_values.add(value)
+        return errors
+
+    # Decide how a new stream connection is treated: None to stream, or an error status to reply with
+    def connect(self):
+        with self.lock:
+            self.connections += 1
+            if self.options.rate_limit_every and self.connections % self.options.rate_limit_every == 0:
+                return 429
+        return None
+
+    def tweet(self):
+        with self.lock:
+            rules = list(self.rules.values())
+            if not rules:
+                return None
+            rule = self.random.choice(rules)
+            tweet_id = self.next_tweet_id
+            self.next_tweet_id += 1
+            term = self.random.choice(rule_terms(rule))
+            # Like the real stream, report every rule the tweet matches
+            matching_rules = [{"id": other["id"], "tag": other["tag"]} for other in rules if term in rule_terms(other)]
+            words = self.random.sample(WORDS, 5) + [term]
+            self.random.shuffle(words)
+            author_id = str(self.random.randint(1000, 1000000))
+            location = self.random.choice(LOCATIONS)
+
+        user = {"id": author_id, "name": "User " + author_id, "username": "user" + author_id}
+        if location:
+            user["location"] = location
+        return {
+            "data": {
+                "author_id": author_id,
+                "created_at": self.now(),
+                "id": str(1400000000000000000 + tweet_id),
+                "lang": "en",
+                "source": "Fake Twitter",
+                "text": " ".join(words),
+            },
+            "includes": {"users": [user]},
+            "matching_rules": matching_rules,
+        }
+
+    @staticmethod
+    def now():
+        return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    twitter = None
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == RULES_PATH:
+            self.send_json(200, self.twitter.list_rules())
+        elif path == STREAM_PATH:
+            self.stream()
+        else:
+            self.send_json(404, {"title": "Not Found"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if path == RULES_PATH:
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                self.send_json(400, {"title": "Invalid Request", "detail": "Body is not JSON"})
+                return
+            status, response = self.twitter.change_rules(payload)
+            self.send_json(status, response)
+        elif path == TOKEN_PATH:
+            self.send_json(200, {"token_type": "bearer", "access_token": "fake-bearer-token"})
+        else:
+            self.send_json(404, {"title": "Not Found"})
+
+    def stream(self):
+        status = self.twitter.connect()
+        if status is not None:
+            self.send_json(status, {"title": "Too Many Requests", "status": status})
+            return
+
+        options = self.twitter.options
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        interval = 1 / options.rate if options.rate else 0
+        sent = 0
+        last_write = time.monotonic()
+        try:
+            while not options.disconnect_after or sent < options.disconnect_after:
+                tweet = self.twitter.tweet()
+                if tweet is not None:
+                    self.write_chunk(json.dumps(tweet).encode() + b"\r\n")
+                    sent += 1
+                    last_write = time.monotonic()
+                elif time.monotonic() - last_write >= options.heartbeat:
+                    self.write_chunk(b"\r\n")
+                    last_write = time.monotonic()
+
+                if interval:
+                    time.sleep(interval)
+                elif tweet is None:
+                    time.sleep(0.1)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        # Simulate Twitter dropping the connection
+        self.close_connection = True
+
+    def write_chunk(self, data):
+        self.wfile.write("{:X}\r\n".format(len(data)).encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.twitter.options.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake of the Twitter v2 filtered stream and rules endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rate", type=float, default=10, help="tweets per second per connection, 0 for unthrottled")
+    parser.add_argument("--heartbeat", type=float, default=20, help="seconds between keep-alive newlines when idle")
+    parser.add_argument("--disconnect-after", type=int, default=0, help="drop each connection after this many tweets")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth connection with a 429")
+    parser.add_argument("--max-rules", type=int, default=25)
+    parser.add_argument("--max-clauses", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible tweets")
+    parser.add_argument("--verbose", action="store_true")
+    options = parser.parse_args()
+
+    FakeTwitterHandler.twitter = FakeTwitter(options)
+    server = ThreadingHTTPServer((options.host, options.port), FakeTwitterHandler)
+    print("Fake Twitter listening on http://{}:{}".format(options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Replays a recorded filtered stream (one tweet JSON per line, as received by get_stream) through the
+# streamer pipeline without connecting to Twitter, then reports throughput and per-stage latency.
+#
+#   python replay_streamer.py recorded_stream.jsonl --rate 200
+#
+# Recordings can be captured from the live worker by setting STREAM_RECORD_PATH.
+import argparse
+import time
+
+from controllers.streams_controller import MyTwitter
+from fastapi import FastAPI
+# Import os and dotenv to read data from env file
+import os
+from dotenv import load_dotenv
+# Middleware
+from fastapi_sqlalchemy import DBSessionMiddleware  # middleware helper
+from starlette.middleware.sessions import SessionMiddleware
+
+load_dotenv()
+
+app = FastAPI()
+app.add_middleware(SessionMiddleware, secret_key=os.getenv('SECRET_KEY'))
+app.add_middleware(DBSessionMiddleware, db_url=os.getenv('MYSQLURLPATH'))
+
+
+def feed(twitter, path, rate):
+    interval = 1 / rate if rate else 0
+    fed = 0
+    next_send = time.perf_counter()
+
+    with open(path, "rb") as stream_file:
+        for line in stream_file:
+            line = line.strip()
+            # Blank lines are the stream's keep-alive heartbeats
+            if not line:
+                continue
+            twitter.stream_queue.put((None, line))
+            fed += 1
+
+            if interval:
+                next_send += interval
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    return fed
+
+
+# Wait until every fed tweet has gone through storing, every new tweet through scoring
+# and every stored post through categorising
+def wait_for_pipeline(twitter, fed, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        # Fused mode scores and categorises inside the store stage
+        if twitter.fused_pipeline and twitter.stats.stage_items("store") >= fed:
+            return True
+        if twitter.stats.stage_items("store") >= fed \
+                and twitter.stats.stage_items("score") >= twitter.stats.count("tweets_stored") \
+                and twitter.stats.stage_items("categorize") >= twitter.stats.count("posts_stored"):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def report(stats, fed, elapsed, finished):
+    stored = stats["counters"].get("posts_stored", 0)
+    print()
+    print("Replayed {} tweets into {} new tweets and {} posts in {:.2f}s{}".format(
+        fed, stats["counters"].get("tweets_stored", 0), stored, elapsed,
+        "" if finished else " (timed out before the pipeline drained)"))
+    print("  {:.1f} tweets/s, {:.1f} posts/s end to end".format(fed / elapsed, stored / elapsed))
+    print()
+    print("  {:<12} {:>8} {:>8} {:>14} {:>14} {:>14}".format(
+        "stage", "batches", "items", "ms/batch", "max ms/batch", "ms/item"))
+    for stage in ("store", "decode", "insert", "score", "categorize"):
+        timing = stats["stages"].get(stage)
+        if not timing:
+            continue
+        print("  {:<12} {:>8} {:>8} {:>14.2f} {:>14.2f} {:>14.3f}".format(
+            stage, timing["batches"], timing["items"],
+            timing["seconds"] / timing["batches"] * 1000,
+            timing["max_seconds"] * 1000,
+            timing["seconds"] / max(timing["items"], 1) * 1000))
+
+    failures = {name: count for name, count in stats["counters"].items() if name.endswith("_failures")}
+    if failures:
+        print()
+        print("  failures: {}".format(failures))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded tweet stream through the ingest pipeline")
+    parser.add_argument("path", help="newline delimited filtered stream JSON")
+    parser.add_argument("--rate", type=float, default=0, help="tweets per second, 0 replays as fast as possible")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for the pipeline to drain")
+    args = parser.parse_args()
+
+    # Replays feed the stages directly, they should not pick up a live worker's spool
+    os.environ.pop('SPOOL_DIR', None)
+    twitter = MyTwitter(live=False)
+
+    start = time.perf_counter()
+    fed = feed(twitter, args.path, args.rate)
+    finished = wait_for_pipeline(twitter, fed, args.timeout)
+    elapsed = time.perf_counter() - start
+
+    report(twitter.stats.snapshot(), fed, elapsed, finished)
+
+
+if __name__ == "__main__":
+    main()
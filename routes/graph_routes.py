@@ -17,6 +17,13 @@ router = APIRouter(
 )
 
 
+# All the charts below in one request, the user is looked up once and the queries run concurrently
+@router.post("/dashboard")
+def get_dashboard(start_date: datetime = Form(...), end_date: datetime = Form(...), granularity: str = Form(...),
+                  user=Depends(auth.get_user_from_token)):
+    return graphs_controller.dashboard(user, start_date, end_date, granularity)
+
+
 @router.post("/collected_conversations")
 def get_graphs(req: Request, start_date: datetime = Form(...), end_date: datetime = Form(...), granularity: str = Form(...), db: Session = Depends(get_db)):
     graph_result = graphs_controller.daily_collected_conversations(db, start_date, end_date, granularity, req.headers['token'])
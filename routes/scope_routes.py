@@ -23,8 +23,8 @@ def get_scopes(req: Request, db: Session = Depends(get_db)):
     return all_scopes
 
 
-# Route to store a scope
-@router.post("/create", response_model=scopes_dto.Scope)
+# Route to store a scope, the stream rules are synced in the background
+@router.post("/create", response_model=scopes_dto.CreatedScope)
 def scope_create(req: Request, scope: str = Form(...), db: Session = Depends(get_db)):
     db_scope = scopes_controller.create_scope(db, scope, req.headers['token'])
     if db_scope is None:
@@ -45,17 +45,27 @@ def read_scope(scope_id: int, req: Request, db: Session = Depends(get_db)):
 # Update specified scope
 @router.post("/update/{scope_id}")  # , response_model=group_categories.GroupCategory
 def update_scope(scope_id: int, scope: str = Form(...), db: Session = Depends(get_db)):
-    db_scope = scopes_controller.update_scope(
+    db_scope, sync_job_id = scopes_controller.update_scope(
         db, scope_id, scope)
-    if db_scope is None:
+    if not db_scope:
         raise HTTPException(status_code=404, detail="Scope not found")
-    return {"message": "Scope has been updated successfully"}
+    return {"message": "Scope has been updated successfully", "sync_job_id": sync_job_id}
 
 
 # Delete specified scope
 @router.post("/delete/{scope_id}")
 def delete_scope(scope_id: int, db: Session = Depends(get_db)):
-    db_scope = scopes_controller.delete_scope(
+    db_scope, sync_job_id = scopes_controller.delete_scope(
         db, scope_id)
-    if db_scope == 1:
-        return {"message": "Scope has been deleted successfully"}
+    if not db_scope:
+        raise HTTPException(status_code=404, detail="Scope not found")
+    return {"message": "Scope has been deleted successfully", "sync_job_id": sync_job_id}
+
+
+# Check on the stream rule sync started by a scope change
+@router.get("/sync/{job_id}", response_model=scopes_dto.RuleSyncJob)
+def read_rule_sync(job_id: str):
+    sync_job = scopes_controller.get_rule_sync(job_id)
+    if sync_job is None:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return sync_job
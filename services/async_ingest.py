@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from services.stage_records import TweetRecord, PostRecord
+from services.stage_queue import BoundedStageQueue, BLOCK
+from services.stream_supervisor import DISCONNECT, NETWORK
+
+
+# Stream items are (offset, received line) and lines never contain a newline
+def serialize_stream_item(item):
+    return item[1]
+
+
+def deserialize_stream_item(line):
+    return None, line.rstrip(b"\n")
+
+
+# Stage records are spilled as JSON arrays in field order
+def serialize_record(record):
+    return json.dumps(record, default=str).encode()
+
+
+def deserialize_record(record_type):
+    def deserialize(line):
+        record = record_type(*json.loads(line))
+        # JSON has no tuples, the offset comes back as a list
+        if record.spool_offset is not None:
+            return record._replace(spool_offset=tuple(record.spool_offset))
+        return record
+    return deserialize
+
+
+class AsyncIngestRuntime:
+    """
+    asyncio version of the streamer worker: one coroutine reads the filtered stream and one per stage drains
+    its queue in batches. Every queue is bounded and INGEST_BACKPRESSURE (block, drop or spill) decides what
+    happens when one fills up, so a slow database can no longer grow the worker's memory without limit.
+    The db work itself runs on a small thread pool as the models and driver are synchronous.
+    """
+
+    def __init__(self, twitter, queue_size=None, policy=None, spill_dir=None, db_workers=None) -> None:
+        self.twitter = twitter
+        queue_size = queue_size or int(os.getenv('INGEST_QUEUE_SIZE', 10000))
+        policy = policy or os.getenv('INGEST_BACKPRESSURE', BLOCK)
+        spill_dir = spill_dir or os.getenv('INGEST_SPILL_DIR', 'spill')
+        self.stats_interval = int(os.getenv('INGEST_STATS_SECONDS', 60))
+
+        self.stream_queue = BoundedStageQueue("stream", queue_size, policy, spill_dir,
+                                              serialize_stream_item, deserialize_stream_item)
+        self.sentiment_queue = BoundedStageQueue("sentiment", queue_size, policy, spill_dir,
+                                                 serialize_record, deserialize_record(TweetRecord),
+                                                 on_drop=twitter.tweet_dropped)
+        self.categorize_post_queue = BoundedStageQueue("categorize", queue_size, policy, spill_dir,
+                                                       serialize_record, deserialize_record(PostRecord),
+                                                       on_drop=twitter.post_dropped)
+        for queue in (self.stream_queue, self.sentiment_queue, self.categorize_post_queue):
+            twitter.stats.gauge("queue_depth", queue.depth, queue=queue.name)
+            # Totals since the start, read from the queue like its depth
+            twitter.stats.gauge("queue_dropped", lambda queue=queue: queue.dropped, queue=queue.name)
+            twitter.stats.gauge("queue_spilled", lambda queue=queue: queue.spilled, queue=queue.name)
+        self.db_executor = ThreadPoolExecutor(max_workers=db_workers or int(os.getenv('INGEST_DB_WORKERS', 3)))
+
+    def queue_stats(self):
+        return {queue.name: queue.stats()
+                for queue in (self.stream_queue, self.sentiment_queue, self.categorize_post_queue)}
+
+    async def run(self, headers):
+        await asyncio.gather(
+            self.consume_stream(headers),
+            self.store_streams(),
+            self.score_sentiment(),
+            self.check_post_is_about_category(),
+            self.report_stats(),
+        )
+
+    async def consume_stream(self, headers):
+        supervisor = self.twitter.stream_supervisor
+        url = self.twitter.stream_url()
+        # The read timeout is the stall window: a healthy stream sends at least a keep-alive newline
+        async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=supervisor.stall_timeout)) as client:
+            while True:
+                connected = False
+                try:
+                    async with client.stream("GET", url, headers=headers) as response:
+                        print(response)
+                        if response.status_code != 200:
+                            await response.aread()
+                            print(response.text)
+                            delay = supervisor.failed(supervisor.classify_status(response.status_code),
+                                                      supervisor.retry_after(response.headers))
+                        else:
+                            connected = True
+                            supervisor.connected()
+                            async for response_line in response.aiter_lines():
+                                supervisor.activity()
+                                response_line = response_line.strip().encode()
+                                if response_line:
+                                    self.twitter.stats.increment("stream_lines_received")
+                                    self.twitter.stats.increment("stream_bytes_received", len(response_line))
+                                    self.twitter.record_stream_line(response_line)
+                                    await self.stream_queue.put((None, response_line))
+                            delay = supervisor.failed(DISCONNECT)
+                except Exception as e:
+                    print(e)
+                    delay = supervisor.failed(supervisor.read_failure() if connected else NETWORK)
+                await asyncio.sleep(delay)
+
+    async def store_streams(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            stream_batch = await self.stream_queue.get_batch(self.twitter.insert_batch_size,
+                                                             self.twitter.insert_batch_wait)
+            new_tweets, stored_posts = await loop.run_in_executor(self.db_executor, self.twitter.store_stream_batch,
+                                                                  stream_batch)
+            for new_tweet in new_tweets:
+                await self.sentiment_queue.put(new_tweet)
+            for db_stream in stored_posts:
+                await self.categorize_post_queue.put(db_stream)
+
+    async def score_sentiment(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            tweets_to_score = await self.sentiment_queue.get_batch(self.twitter.sentiment_batch_size,
+                                                                   self.twitter.sentiment_batch_wait)
+            await loop.run_in_executor(self.db_executor, self.twitter.score_tweets, tweets_to_score)
+
+    async def check_post_is_about_category(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            posts_to_categorize = await self.categorize_post_queue.get_batch(self.twitter.categorize_batch_size,
+                                                                             self.twitter.categorize_batch_wait)
+            await loop.run_in_executor(self.db_executor, self.twitter.categorize_posts, posts_to_categorize)
+
+    async def report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            print("ingest queues {}".format(self.queue_stats()))
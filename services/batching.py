@@ -0,0 +1,20 @@
+import time
+from queue import Empty
+
+
+# Block until at least one item is available, then keep pulling items off the queue
+# until the batch is full or max_wait seconds have passed since the first item arrived
+def drain_batch(queue, max_items, max_wait):
+    batch = [queue.get()]
+    deadline = time.monotonic() + max_wait
+
+    while len(batch) < max_items:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(queue.get(timeout=remaining))
+        except Empty:
+            break
+
+    return batch
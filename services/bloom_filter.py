@@ -0,0 +1,34 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Fixed size set membership test with no false negatives and roughly error_rate false positives
+    once capacity keys have been added.
+    """
+
+    def __init__(self, capacity, error_rate=0.001) -> None:
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    # Double hashing: k positions from the two halves of one 128 bit digest
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def is_full(self):
+        return self.count >= self.capacity
@@ -0,0 +1,90 @@
+import datetime
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+from services.single_flight import SingleFlight
+
+
+class ChartCache:
+    """
+    LRU cache of chart results for the graph controller, keyed by the chart and its arguments.
+    Identical queries running at the same time are computed once whether or not they could be cached.
+    Each entry remembers the user's ingest and category versions it was computed at (see ingest_watermarks):
+      closed - the range ended more than `lateness` seconds before the user's watermark, so the stream
+               will not add to it. Kept until evicted, or until the user's categories change
+      open   - the range reaches into data still arriving. Dropped once the user's version moves on,
+               and after ttl seconds at the latest
+    """
+
+    def __init__(self, watermarks, max_entries=1000, ttl=60, lateness=600, stats=None) -> None:
+        self.watermarks = watermarks
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lateness = datetime.timedelta(seconds=lateness)
+        self.stats = stats
+        self.lock = threading.Lock()
+        # key -> (result, ingest version, category version, closed, expires_at)
+        self.entries = OrderedDict()
+        self.flights = SingleFlight(stats)
+
+    def get(self, key, user_id, end_date, compute):
+        if not self.max_entries:
+            return self.flights.do(key, compute)
+        try:
+            watermark, ingest_version, category_version = self.watermarks.get(user_id)
+        except Exception as e:
+            print("Could not read the ingest watermark of user {}, not caching".format(user_id))
+            print(e)
+            return self.flights.do(key, compute)
+
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                result, entry_ingest_version, entry_category_version, closed, expires_at = entry
+                if entry_category_version == category_version \
+                        and (closed or (entry_ingest_version == ingest_version and now < expires_at)):
+                    self.entries.move_to_end(key)
+                    self._count("chart_cache_hits")
+                    return result
+                del self.entries[key]
+        self._count("chart_cache_misses")
+
+        # The versions are read before computing, so rows committed meanwhile make the entry stale rather than lost.
+        # Callers only share a computation started at the versions they read, or they could cache an older result
+        result = self.flights.do((key, ingest_version, category_version), compute)
+        closed = watermark is not None and to_utc(end_date) < watermark - self.lateness
+        with self.lock:
+            self.entries[key] = (result, ingest_version, category_version, closed, now + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+    def _count(self, name):
+        if self.stats is not None:
+            self.stats.increment(name)
+
+    # Decorator for chart functions taking start_date, end_date and user; the user is keyed by id
+    def cached(self, function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs).arguments
+            user_id = arguments["user"].id
+            key = (function.__name__,) + tuple(user_id if name == "user" else value for name, value in arguments.items())
+            return self.get(key, user_id, arguments["end_date"], lambda: function(*args, **kwargs))
+        return wrapper
+
+
+# created_at is stored as naive UTC
+def to_utc(value):
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.fromisoformat(str(value))
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
@@ -0,0 +1,126 @@
+import os
+import pickle
+import sys
+
+from sqlalchemy import func
+
+from core.models import schema
+
+
+class Gazetteer:
+    """
+    In-memory copy of the countries, states and cities tables used to resolve a user's free text location.
+    Names are kept in hashed sets plus a city -> (state, country) map, so resolving a location never touches the db.
+    The fingerprint is the row count and max id of each table it was built from, see fingerprint().
+    """
+
+    def __init__(self, countries, states, cities, city_regions, fingerprint=None) -> None:
+        self.countries = frozenset(countries)
+        self.states = frozenset(states)
+        self.cities = frozenset(cities)
+        self.city_regions = city_regions
+        self.fingerprint = fingerprint
+
+    # (row count, max id) of countries, states and cities. Rows added or deleted change it, renames do not
+    @staticmethod
+    def fingerprint(session):
+        return tuple(tuple(session.query(func.count(table.id), func.max(table.id)).one())
+                     for table in (schema.Country, schema.State, schema.City))
+
+    @classmethod
+    def from_session(cls, session):
+        fingerprint = cls.fingerprint(session)
+        countries = {country.id: country.country_name
+                     for country in session.query(schema.Country).order_by(schema.Country.id)}
+        states = {state.id: (state.state_name, state.country_id)
+                  for state in session.query(schema.State).order_by(schema.State.id)}
+
+        city_regions = {}
+        cities = []
+        for city in session.query(schema.City).order_by(schema.City.id):
+            city_name = city.city_name.lower()
+            cities.append(city_name)
+
+            state_name, country_id = states.get(city.state_id, (None, None))
+            # Same rows the old states/countries/cities join returned, first city wins when names repeat
+            if state_name is not None and country_id in countries:
+                city_regions.setdefault(city_name, (state_name, countries[country_id]))
+
+        return cls([name.lower() for name in countries.values() if name],
+                   [name.lower() for name, _ in states.values() if name],
+                   cities,
+                   city_regions,
+                   fingerprint)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as gazetteer_file:
+            data = pickle.load(gazetteer_file)
+        # Files written before the fingerprint was kept have none, and never match
+        return cls(*data)
+
+    # Load from path when the file was built from the tables as they are now,
+    # otherwise build from the db and write it there for next time
+    @classmethod
+    def load_or_build(cls, path, session):
+        if path and os.path.exists(path):
+            try:
+                gazetteer = cls.load(path)
+            except Exception as e:
+                print("Could not read the gazetteer file {}, rebuilding it".format(path))
+                print(e)
+            else:
+                if gazetteer.fingerprint == cls.fingerprint(session):
+                    return gazetteer
+                print("The locations tables changed since {} was built, rebuilding it".format(path))
+
+        gazetteer = cls.from_session(session)
+        if path:
+            gazetteer.save(path)
+        return gazetteer
+
+    def save(self, path):
+        data = (sorted(self.countries), sorted(self.states), sorted(self.cities), self.city_regions, self.fingerprint)
+        with open(path, "wb") as gazetteer_file:
+            pickle.dump(data, gazetteer_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def resolve(self, location):
+        location = location.replace("-", ',')
+        location_list = location.lower().split(',')
+
+        country_name = ''
+        state_name = ''
+        city_name = ''
+
+        for loc in location_list:
+            loc = loc.strip()
+            if len(loc) > 1:
+                if loc in self.countries:
+                    country_name = loc
+                elif loc in self.states:
+                    state_name = loc
+                elif loc in self.cities:
+                    city_name = loc
+
+                    if city_name in 'greater accra':
+                        city_name = 'greater accra'
+
+                    if not state_name and city_name in self.city_regions:
+                        state_name, country_name = self.city_regions[city_name]
+
+        return country_name, state_name, city_name
+
+
+# Rebuild the gazetteer file from the db: python -m services.gazetteer [path]
+if __name__ == "__main__":
+    from core.models.database import SessionLocal
+
+    gazetteer_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv('GAZETTEER_PATH')
+    db_session = SessionLocal()
+    try:
+        built = Gazetteer.from_session(db_session)
+    finally:
+        db_session.close()
+    built.save(gazetteer_path)
+    print("Saved {} countries, {} states and {} cities to {}".format(
+        len(built.countries), len(built.states), len(built.cities), gazetteer_path))
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from sqlalchemy import text
+
+# The worker bumps a user's version whenever posts of theirs become visible in post_data_categorised_view,
+# and keeps the newest created_at it has made visible as their watermark
+ADVANCE = text("INSERT INTO ingest_watermarks (user_id, watermark, version) VALUES (:user_id, :watermark, 1) "
+               "ON DUPLICATE KEY UPDATE watermark = GREATEST(watermark, VALUES(watermark)), version = version + 1")
+
+# Category edits change what the charts show as well, keyword_changes already logs them per user
+READ = text("SELECT (SELECT watermark FROM ingest_watermarks WHERE user_id = :user_id) AS watermark, "
+            "(SELECT version FROM ingest_watermarks WHERE user_id = :user_id) AS version, "
+            "(SELECT MAX(id) FROM keyword_changes WHERE user_id = :user_id) AS keyword_change")
+
+
+# posts are (user_id, created_at) of posts that just became visible
+def advance_watermarks(connection, posts):
+    watermarks = {}
+    for user_id, created_at in posts:
+        watermarks[user_id] = max(watermarks.get(user_id, created_at), created_at)
+    if watermarks:
+        connection.execute(ADVANCE, [dict(user_id=user_id, watermark=watermark)
+                                     for user_id, watermark in sorted(watermarks.items())])
+
+
+class IngestWatermarks:
+    """
+    Reads a user's watermark, ingest version and latest category change for the web process,
+    re-reading each user at most every poll_interval seconds.
+    """
+
+    def __init__(self, engine, poll_interval=1.0) -> None:
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        # user_id -> (read at, (watermark, ingest version, category version))
+        self.read_at = {}
+
+    # (watermark, ingest version, category version), the versions are 0 until there is anything to count
+    def get(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.read_at.get(user_id)
+        if cached is not None and now - cached[0] < self.poll_interval:
+            return cached[1]
+
+        with self.engine.connect() as connection:
+            row = connection.execute(READ, user_id=user_id).first()
+        current = (row.watermark, row.version or 0, row.keyword_change or 0)
+        with self.lock:
+            self.read_at[user_id] = (now, current)
+        return current
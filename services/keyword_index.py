@@ -0,0 +1,82 @@
+import time
+
+from fastapi_sqlalchemy import db
+from sqlalchemy import func
+
+from core.models import schema
+from services.keyword_matcher import KeywordMatcher
+
+
+class KeywordIndex:
+    """
+    Keeps the streamer's KeywordMatcher in step with the keywords table without restarting.
+    The category controller appends to keyword_changes whenever keywords are edited; refresh() reads the
+    changes it has not applied yet, recompiles only the users involved and swaps the new matcher in whole,
+    so posts being matched keep using the old one until the new one is ready.
+    Ids are handed out before commit, so a change can become visible after a higher id was already read.
+    Each refresh re-reads the last `window` ids below the watermark and skips the ones already applied.
+    """
+
+    def __init__(self, window=1000) -> None:
+        self.matcher = KeywordMatcher()
+        self.watermark = 0
+        self.window = window
+        # Ids above watermark - window that have been applied
+        self.applied = set()
+
+    def load(self):
+        with db():
+            # Take the watermark first so changes made while loading are picked up by the next refresh
+            watermark = db.session.query(func.max(schema.KeywordChange.id)).scalar() or 0
+            applied = {change.id for change in self.query_changes(db.session, watermark - self.window)}
+            self.matcher = KeywordMatcher.from_keyword_rows(self.query_keyword_rows(db.session))
+            self.watermark = watermark
+            self.applied = applied
+
+    def refresh(self):
+        with db():
+            changes = [change for change in self.query_changes(db.session, self.watermark - self.window)
+                       if change.id not in self.applied]
+            if not changes:
+                return
+
+            user_ids = {change.user_id for change in changes}
+            changed_matcher = KeywordMatcher.from_keyword_rows(self.query_keyword_rows(db.session, user_ids))
+
+        automata = dict(self.matcher.automata)
+        for user_id in user_ids:
+            automata.pop(user_id, None)
+        automata.update(changed_matcher.automata)
+
+        self.matcher = KeywordMatcher(automata)
+        self.watermark = max(self.watermark, max(change.id for change in changes))
+        self.applied.update(change.id for change in changes)
+        self.applied = {change_id for change_id in self.applied if change_id > self.watermark - self.window}
+        print("Refreshed keywords for users {}".format(sorted(user_ids)))
+
+    def watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Could not refresh keywords")
+                print(e)
+
+    def match(self, user_id, text):
+        return self.matcher.match(user_id, text)
+
+    @staticmethod
+    def query_changes(session, after_id):
+        return session.query(schema.KeywordChange.id, schema.KeywordChange.user_id) \
+            .filter(schema.KeywordChange.id > after_id) \
+            .all()
+
+    @staticmethod
+    def query_keyword_rows(session, user_ids=None):
+        query = session.query(schema.GroupCategory.user_id, schema.Keyword.category_id, schema.Keyword.keywords) \
+            .join(schema.Category, schema.Keyword.category_id == schema.Category.id) \
+            .join(schema.GroupCategory, schema.GroupCategory.id == schema.Category.group_category_id)
+        if user_ids is not None:
+            query = query.filter(schema.GroupCategory.user_id.in_(user_ids))
+        return query.all()
@@ -0,0 +1,95 @@
+from collections import deque
+
+
+# Keywords are stored as one comma separated string per category
+def parse_keywords(keywords):
+    if not keywords:
+        return []
+    return [keyword.lower().strip() for keyword in keywords.split(",") if keyword.strip()]
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over (pattern, value) pairs.
+    search(text) scans the text once and returns the values of every pattern found in it,
+    so the cost depends on the length of the text and not on the number of patterns.
+    """
+
+    def __init__(self, patterns) -> None:
+        self.transitions = [{}]
+        self.fail = [0]
+        self.outputs = [frozenset()]
+
+        for pattern, value in patterns:
+            self._add(pattern, value)
+        self._link()
+
+    def _add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            next_state = self.transitions[state].get(char)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions[state][char] = next_state
+                self.transitions.append({})
+                self.fail.append(0)
+                self.outputs.append(frozenset())
+            state = next_state
+        self.outputs[state] = self.outputs[state] | {value}
+
+    # Breadth first pass that sets the failure link of every state and merges the outputs
+    # of the failure states in, so a search never has to walk the failure chain for outputs
+    def _link(self):
+        pending = deque(self.transitions[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self.transitions[state].items():
+                pending.append(next_state)
+
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.transitions[fallback].get(char, 0) if state else 0
+                self.outputs[next_state] = self.outputs[next_state] | self.outputs[self.fail[next_state]]
+
+    def search(self, text):
+        transitions = self.transitions
+        fail = self.fail
+        outputs = self.outputs
+
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
+
+
+class KeywordMatcher:
+    """
+    Category keywords compiled into one automaton per user.
+    match(user_id, text) returns the ids of every category of that user the text is about.
+    """
+
+    def __init__(self, automata=None) -> None:
+        self.automata = automata or {}
+
+    # keyword_rows are (user_id, category_id, keywords) with keywords as stored in the keywords table
+    @classmethod
+    def from_keyword_rows(cls, keyword_rows):
+        patterns_by_user = {}
+        for user_id, category_id, keywords in keyword_rows:
+            patterns = patterns_by_user.setdefault(user_id, [])
+            for keyword in parse_keywords(keywords):
+                patterns.append((keyword, category_id))
+
+        return cls({user_id: KeywordAutomaton(patterns) for user_id, patterns in patterns_by_user.items()})
+
+    def match(self, user_id, text):
+        automaton = self.automata.get(user_id)
+        if automaton is None or not text:
+            return set()
+        return automaton.search(text.lower())
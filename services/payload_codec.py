@@ -0,0 +1,105 @@
+import re
+import struct
+import sys
+import threading
+import zlib
+from collections import Counter
+
+from sqlalchemy import select
+
+from core.models import schema
+from core.models.database import engine
+
+# Every payload starts with the id of the dictionary it was compressed with, 0 for none
+HEADER = struct.Struct(">I")
+# Deflate only looks 32KB back, a longer dictionary is never used
+MAX_DICTIONARY_BYTES = 32 * 1024
+# JSON keys and short string values, the parts tweets repeat between each other
+FRAGMENT_PATTERN = re.compile(rb'"(?:[^"\\]|\\.){1,64}"\s*:?')
+
+
+# Build a preset dictionary out of the fragments most tweet payloads share
+def train_dictionary(samples, size=MAX_DICTIONARY_BYTES):
+    document_counts = Counter()
+    for sample in samples:
+        document_counts.update(set(FRAGMENT_PATTERN.findall(sample)))
+
+    ranked = sorted((fragment for fragment, count in document_counts.items() if count > 1),
+                    key=lambda fragment: document_counts[fragment] * len(fragment), reverse=True)
+    chosen = []
+    total = 0
+    for fragment in ranked:
+        if total + len(fragment) > size:
+            continue
+        chosen.append(fragment)
+        total += len(fragment)
+    # Matches close to the end of the dictionary are the cheapest to encode, so the best fragments go last
+    return b"".join(reversed(chosen))
+
+
+class PayloadCodec:
+    """
+    Raw deflate with a shared preset dictionary, for storing received tweet payloads.
+    Old dictionaries are kept so payloads compressed before a retrain can still be read.
+    """
+
+    def __init__(self, dictionaries=None, dictionary_id=0) -> None:
+        self.dictionaries = dict(dictionaries or {})
+        self.dictionary_id = dictionary_id
+
+    @staticmethod
+    def dictionary_of(payload):
+        return HEADER.unpack_from(payload)[0]
+
+    def compress(self, raw):
+        options = {"zdict": self.dictionaries[self.dictionary_id]} if self.dictionary_id else {}
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, **options)
+        return HEADER.pack(self.dictionary_id) + compressor.compress(raw) + compressor.flush()
+
+    def decompress(self, payload):
+        dictionary_id = self.dictionary_of(payload)
+        options = {"zdict": self.dictionaries[dictionary_id]} if dictionary_id else {}
+        decompressor = zlib.decompressobj(-15, **options)
+        return decompressor.decompress(payload[HEADER.size:]) + decompressor.flush()
+
+
+# Codec with every stored dictionary, compressing with the newest one
+def load_codec(connection):
+    dictionaries_table = schema.PayloadDictionary.__table__
+    dictionaries = {row.id: row.dictionary for row in connection.execute(
+        select([dictionaries_table.c.id, dictionaries_table.c.dictionary]))}
+    return PayloadCodec(dictionaries, max(dictionaries) if dictionaries else 0)
+
+
+_shared_codec = None
+_shared_codec_lock = threading.Lock()
+
+
+# Process wide codec for reading payloads, reloaded when a payload needs a dictionary it has not seen
+def shared_codec(dictionary_id=0):
+    global _shared_codec
+    with _shared_codec_lock:
+        if _shared_codec is None or (dictionary_id and dictionary_id not in _shared_codec.dictionaries):
+            with engine.connect() as connection:
+                _shared_codec = load_codec(connection)
+        return _shared_codec
+
+
+def decompress_payload(payload):
+    return shared_codec(PayloadCodec.dictionary_of(payload)).decompress(payload)
+
+
+# Train a new dictionary from a recorded stream and store it; the worker compresses with it after a restart
+#   python -m services.payload_codec recorded_stream.jsonl
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as recording:
+        samples = [line.strip() for line in recording if line.strip()]
+    dictionary = train_dictionary(samples)
+    codec = PayloadCodec({1: dictionary}, 1)
+    raw_bytes = sum(len(sample) for sample in samples)
+    stored_bytes = sum(len(codec.compress(sample)) for sample in samples)
+    with engine.begin() as connection:
+        result = connection.execute(schema.PayloadDictionary.__table__.insert().values(dictionary=dictionary))
+    print("Stored dictionary {} ({} bytes) trained on {} payloads, {:.0f} -> {:.0f} bytes per post".format(
+        result.inserted_primary_key[0], len(dictionary), len(samples),
+        raw_bytes / max(len(samples), 1), stored_bytes / max(len(samples), 1)))
@@ -0,0 +1,149 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, from a millisecond to an hour so the same buckets suit stage latency and ingest lag
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+METRIC_PREFIX = "ingest_"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('"', '\\"')) for name, value in labels) + "}"
+
+
+class PipelineStats:
+    """
+    Thread safe counters, gauges and latency histograms for the streamer pipeline (and the web's chart cache).
+    Each stage records how long a batch took and how many items were in it; per-item values such as
+    lag go into histograms with observe(). render() writes everything in the Prometheus text format.
+    """
+
+    def __init__(self, prefix=METRIC_PREFIX) -> None:
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+        # name -> {labels: callable}, read when rendered so queue depths are always current
+        self.gauges = {}
+
+    def record(self, stage, seconds, items=1):
+        with self.lock:
+            timing = self.stages.setdefault(stage, {"batches": 0, "items": 0, "seconds": 0.0, "max_seconds": 0.0})
+            timing["batches"] += 1
+            timing["items"] += items
+            timing["seconds"] += seconds
+            timing["max_seconds"] = max(timing["max_seconds"], seconds)
+            self._histogram("stage_batch_seconds", (("stage", stage),)).observe(seconds)
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self._histogram(name, tuple(sorted(labels.items()))).observe(value)
+
+    def _histogram(self, name, labels):
+        histogram = self.histograms.setdefault(name, {}).get(labels)
+        if histogram is None:
+            histogram = self.histograms[name][labels] = Histogram()
+        return histogram
+
+    def gauge(self, name, read, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = read
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def stage_items(self, stage):
+        with self.lock:
+            return self.stages.get(stage, {}).get("items", 0)
+
+    def snapshot(self):
+        with self.lock:
+            return {"stages": {stage: dict(timing) for stage, timing in self.stages.items()},
+                    "counters": dict(self.counters)}
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append("# TYPE {}{}_total counter".format(self.prefix, name))
+                lines.append("{}{}_total {}".format(self.prefix, name, value))
+
+            if self.stages:
+                lines.append("# TYPE {}stage_items_total counter".format(self.prefix))
+                for stage, timing in sorted(self.stages.items()):
+                    lines.append("{}stage_items_total{} {}".format(
+                        self.prefix, format_labels((("stage", stage),)), timing["items"]))
+
+            for name, histograms in sorted(self.histograms.items()):
+                lines.append("# TYPE {}{} histogram".format(self.prefix, name))
+                for labels, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        lines.append("{}{}_bucket{} {}".format(
+                            self.prefix, name, format_labels(labels + (("le", bound),)), cumulative))
+                    lines.append("{}{}_sum{} {}".format(self.prefix, name, format_labels(labels), histogram.sum))
+                    lines.append("{}{}_count{} {}".format(self.prefix, name, format_labels(labels), histogram.count))
+
+            gauges = {name: dict(readers) for name, readers in self.gauges.items()}
+
+        for name, readers in sorted(gauges.items()):
+            lines.append("# TYPE {}{} gauge".format(self.prefix, name))
+            for labels, read in sorted(readers.items()):
+                try:
+                    value = read()
+                except Exception as e:
+                    print("Could not read gauge {}".format(name))
+                    print(e)
+                    continue
+                lines.append("{}{}{} {}".format(self.prefix, name, format_labels(labels), value))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    stats = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.stats.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve the stats on http://host:port/metrics from a background thread
+def serve_metrics(stats, port, host="127.0.0.1"):
+    handler = type("PipelineMetricsHandler", (MetricsHandler,), {"stats": stats})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("Serving metrics on http://{}:{}/metrics".format(host, port))
+    return server
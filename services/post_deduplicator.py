@@ -0,0 +1,108 @@
+import datetime
+
+from sqlalchemy import and_, select
+
+from core.models import schema
+from core.models.database import engine
+from services.bloom_filter import BloomFilter
+
+
+def post_key(user_id, data_id):
+    return "{}:{}".format(user_id, data_id)
+
+
+class PostDeduplicator:
+    """
+    Drops posts already stored for the same (user_id, data_id) before they are inserted.
+    Stored is not the same as processed: a redelivery after a crash or a failed score or categorise batch
+    finds its post stored but maybe not scored or categorised, so the ids of stored posts are handed back
+    for the caller to check with unfinished_stages().
+    A Bloom filter of recent keys answers "definitely new" for almost every post without touching the db;
+    only the keys it may have seen are checked, in one query per batch. The unique key on posts is the
+    final word for anything older than the filter remembers.
+    Two generations of filter are kept so the oldest keys age out instead of the error rate creeping up.
+    """
+
+    def __init__(self, capacity, error_rate=0.001) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = None
+
+    def __contains__(self, key):
+        return key in self.current or (self.previous is not None and key in self.previous)
+
+    def add(self, key):
+        if self.current.is_full():
+            self.previous = self.current
+            self.current = BloomFilter(self.capacity, self.error_rate)
+        self.current.add(key)
+
+    # Rebuild the filter from the posts stored in the last few days
+    def load_recent(self, days):
+        since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+        posts_table = schema.Post.__table__
+        tweets_table = schema.Tweet.__table__
+        query = select([posts_table.c.user_id, tweets_table.c.data_id]) \
+            .select_from(posts_table.join(tweets_table, posts_table.c.tweet_id == tweets_table.c.id)) \
+            .where(posts_table.c.created_at >= since)
+
+        loaded = 0
+        with engine.connect() as connection:
+            for row in connection.execution_options(stream_results=True).execute(query):
+                self.add(post_key(row.user_id, row.data_id))
+                loaded += 1
+        print("Loaded {} recent posts into the duplicate filter".format(loaded))
+
+    # Indexes of the rows that are not duplicates, of each other or of stored posts, and
+    # index -> (post id, tweet id) for the first row of each post that is already stored
+    def new_row_indexes(self, connection, post_rows):
+        keys = [post_key(post_row["user_id"], post_row["data_id"]) for post_row in post_rows]
+
+        maybe_seen = [index for index, key in enumerate(keys) if key in self]
+        stored = {}
+        if maybe_seen:
+            posts_table = schema.Post.__table__
+            tweets_table = schema.Tweet.__table__
+            data_ids = list({post_rows[index]["data_id"] for index in maybe_seen})
+            user_ids = list({post_rows[index]["user_id"] for index in maybe_seen})
+            stored_rows = connection.execute(
+                select([posts_table.c.id, posts_table.c.tweet_id, posts_table.c.user_id, tweets_table.c.data_id])
+                .select_from(posts_table.join(tweets_table, posts_table.c.tweet_id == tweets_table.c.id))
+                .where(and_(tweets_table.c.data_id.in_(data_ids), posts_table.c.user_id.in_(user_ids)))
+            )
+            stored = {post_key(stored_row.user_id, stored_row.data_id): (stored_row.id, stored_row.tweet_id)
+                      for stored_row in stored_rows}
+
+        new_indexes = []
+        stored_indexes = {}
+        batch_keys = set()
+        for index, key in enumerate(keys):
+            if key in batch_keys:
+                continue
+            batch_keys.add(key)
+            if key in stored:
+                stored_indexes[index] = stored[key]
+            else:
+                new_indexes.append(index)
+        return new_indexes, stored_indexes
+
+    def remember(self, post_rows):
+        for post_row in post_rows:
+            self.add(post_key(post_row["user_id"], post_row["data_id"]))
+
+
+# Of the given stored tweets and posts, the ids of the tweets without a score and of the posts
+# without a category. A post that matched none of its user's keywords has no category either
+def unfinished_stages(connection, tweet_ids, post_ids):
+    unscored = set(tweet_ids)
+    if unscored:
+        scores_table = schema.TweetSentimentScore.__table__
+        unscored -= {row.tweet_id for row in connection.execute(
+            select([scores_table.c.tweet_id]).where(scores_table.c.tweet_id.in_(list(unscored))))}
+    uncategorised = set(post_ids)
+    if uncategorised:
+        categories_table = schema.PostAboutCategory.__table__
+        uncategorised -= {row.post_id for row in connection.execute(
+            select([categories_table.c.post_id]).where(categories_table.c.post_id.in_(list(uncategorised))))}
+    return unscored, uncategorised
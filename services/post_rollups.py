@@ -0,0 +1,117 @@
+# Hourly rollups of post_data_categorised_view, kept up to date by the streamer worker so the graph
+# queries can sum a few rows per hour instead of counting every post in the range.
+#
+#   python -m services.post_rollups --rebuild
+#
+# rebuilds them from the view. Deleting a category deletes its rollups too (category_controller), this is for
+# anything else that changed the view's history.
+import argparse
+import datetime
+
+from sqlalchemy import bindparam, text
+
+HOUR = datetime.timedelta(hours=1)
+SECOND = datetime.timedelta(seconds=1)
+
+# The view rows matching a condition, counted per rollup key. NULLs are folded into '' so they share a key
+ROLLUP_SELECT = "SELECT user_id, DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00') AS hour, category_id, " \
+                "COALESCE(sentiment_score, '') AS sentiment, COALESCE(country, '') AS country, " \
+                "COALESCE(state, '') AS state, COALESCE(city, '') AS city, COUNT(*) AS added " \
+                "FROM post_data_categorised_view " \
+                "WHERE {} " \
+                "GROUP BY user_id, hour, category_id, sentiment, country, state, city"
+
+ROLLUP_INSERT = "INSERT INTO post_hourly_rollups (user_id, hour, category_id, sentiment, country, state, city, post_count) " \
+                + ROLLUP_SELECT + " " \
+                "ON DUPLICATE KEY UPDATE post_count = post_count + VALUES(post_count)"
+
+# A post shows up in the view once it is categorised and its tweet scored. The worker adds it from whichever
+# of the two stages commits last, so every stage transaction that can complete a post rolls up its posts
+ROLLUP_POSTS = text(ROLLUP_INSERT.format("post_id IN :post_ids")) \
+    .bindparams(bindparam("post_ids", expanding=True))
+ROLLUP_TWEETS = text(ROLLUP_INSERT.format("post_id IN (SELECT id FROM posts WHERE tweet_id IN :tweet_ids)")) \
+    .bindparams(bindparam("tweet_ids", expanding=True))
+
+# Total posts of the chart rows, as an integer rather than MySQL's decimal SUM
+POST_COUNT = "CAST(SUM(post_count) AS SIGNED)"
+
+
+def rollup_posts(connection, post_ids):
+    if post_ids:
+        connection.execute(ROLLUP_POSTS, post_ids=list(post_ids))
+
+
+def rollup_tweets(connection, tweet_ids):
+    if tweet_ids:
+        connection.execute(ROLLUP_TWEETS, tweet_ids=list(tweet_ids))
+
+
+def rebuild(connection):
+    connection.execute("DELETE FROM post_hourly_rollups")
+    connection.execute(text(ROLLUP_INSERT.format("1 = 1")))
+
+
+# The whole hours inside [start_date, end_date] as [first, last), or None when there are none
+def whole_hours(start_date, end_date):
+    first = start_date.replace(minute=0, second=0, microsecond=0)
+    if first < start_date:
+        first += HOUR
+    # created_at has second precision and the range includes end_date
+    last = (end_date + SECOND).replace(minute=0, second=0, microsecond=0)
+    if last <= first:
+        return None
+    return first, last
+
+
+def to_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value))
+
+
+# Chart rows of a user between two dates, as a derived table with the view's created_at, sentiment_score,
+# category_id, country, state and city plus post_count; count with POST_COUNT instead of COUNT(post_id).
+# "rollups" reads whole hours from the rollups and only the partial hours at either end from the view,
+# "view" is for ranges without a whole hour. The statements' text is fixed, chart_rows picks one and its parameters
+CHART_SOURCES = {
+    "view": "(SELECT created_at, sentiment_score, category_id, country, state, city, 1 AS post_count "
+            "FROM post_data_categorised_view "
+            "WHERE user_id = :user_id AND created_at BETWEEN :start_date AND :end_date) AS chart_rows",
+    "rollups": "(SELECT hour AS created_at, sentiment AS sentiment_score, category_id, country, state, city, post_count "
+               "FROM post_hourly_rollups "
+               "WHERE user_id = :user_id AND hour >= :first_hour AND hour < :last_hour "
+               "UNION ALL "
+               "SELECT created_at, sentiment_score, category_id, country, state, city, 1 AS post_count "
+               "FROM post_data_categorised_view "
+               "WHERE user_id = :user_id AND ((created_at >= :start_date AND created_at < :first_hour) "
+               "OR (created_at >= :last_hour AND created_at <= :end_date))) AS chart_rows",
+}
+
+
+# The CHART_SOURCES entry to read a user's rows between two dates from, and its parameters
+def chart_rows(user_id, start_date, end_date):
+    start_date, end_date = to_datetime(start_date), to_datetime(end_date)
+    params = dict(user_id=user_id, start_date=start_date, end_date=end_date)
+    hours = whole_hours(start_date, end_date)
+    if hours is None:
+        return "view", params
+    params["first_hour"], params["last_hour"] = hours
+    return "rollups", params
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the hourly rollups behind the graphs")
+    parser.add_argument("--rebuild", action="store_true", help="recount every rollup from post_data_categorised_view")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    from core.models.database import engine
+    with engine.begin() as connection:
+        rebuild(connection)
+    print("Rebuilt post_hourly_rollups")
+
+
+if __name__ == "__main__":
+    main()
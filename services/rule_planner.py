@@ -0,0 +1,130 @@
+class RuleBin:
+    """ One stream rule being filled: scopes OR-ed together within the length and clause limits. """
+
+    def __init__(self, scopes=None) -> None:
+        self.scopes = list(scopes or [])
+        self.length = len(" OR ".join(self.scopes))
+
+    def fits(self, scope, max_length, max_clauses):
+        added_length = len(scope) + (len(" OR ") if self.scopes else 0)
+        return len(self.scopes) < max_clauses and self.length + added_length <= max_length
+
+    def add(self, scope):
+        self.length += len(scope) + (len(" OR ") if self.scopes else 0)
+        self.scopes.append(scope)
+
+    def copy(self):
+        return RuleBin(self.scopes)
+
+    def value(self):
+        return " OR ".join(self.scopes)
+
+
+class RulePlan:
+    def __init__(self, rules, baseline_rule_count) -> None:
+        self.rules = rules
+        self.baseline_rule_count = baseline_rule_count
+
+    def rules_saved(self):
+        return self.baseline_rule_count - len(self.rules)
+
+
+class RulePlanner:
+    """
+    Packs scopes into as few stream rules as fit Twitter's length and clause limits.
+
+    A tweet is attributed to the union of the tags of every rule it matched, so a scope wanted by users
+    {1, 2, 3} does not need a rule tagged 1,2,3: it can go into a rule tagged 1,2 and one tagged 3.
+    Scopes are first grouped by the exact set of users that want them and each group is packed
+    first-fit-decreasing. Then, smallest first, a group is dissolved into the spare room of groups whose
+    user sets partition its own, whenever that fits without opening a new rule.
+    """
+
+    def __init__(self, max_length=512, max_clauses=30) -> None:
+        self.max_length = max_length
+        self.max_clauses = max_clauses
+
+    # scope_users maps each scope to the ids of the users that want it
+    def plan(self, scope_users):
+        groups = {}
+        for scope, user_ids in scope_users.items():
+            user_ids = frozenset(str(user_id).strip() for user_id in user_ids if str(user_id).strip())
+            if scope and user_ids:
+                groups.setdefault(user_ids, []).append(scope)
+
+        baseline_rule_count = sum(len(self.pack_in_order(scopes)) for scopes in groups.values())
+
+        bins = {user_ids: self.pack(scopes) for user_ids, scopes in groups.items()}
+        self.share_groups(groups, bins)
+
+        rules = []
+        for user_ids in sorted(bins, key=self.tag):
+            for rule_bin in bins[user_ids]:
+                rules.append({"value": rule_bin.value(), "tag": self.tag(user_ids)})
+        return RulePlan(rules, baseline_rule_count)
+
+    @staticmethod
+    def tag(user_ids):
+        return ",".join(sorted(user_ids, key=lambda user_id: (len(user_id), user_id)))
+
+    # First-fit-decreasing: longest scopes first, each into the first rule with room
+    def pack(self, scopes):
+        bins = []
+        self.fill(bins, scopes, open_bins=True)
+        return bins
+
+    # Scopes in the order given, starting a new rule whenever the current one is full
+    def pack_in_order(self, scopes):
+        bins = []
+        for scope in scopes:
+            if not bins or not bins[-1].fits(scope, self.max_length, self.max_clauses):
+                bins.append(RuleBin())
+            bins[-1].add(scope)
+        return bins
+
+    # Place scopes into the given rules, longest first; without open_bins fail instead of adding a rule
+    def fill(self, bins, scopes, open_bins=False):
+        for scope in sorted(scopes, key=len, reverse=True):
+            for rule_bin in bins:
+                if rule_bin.fits(scope, self.max_length, self.max_clauses):
+                    rule_bin.add(scope)
+                    break
+            else:
+                if not open_bins:
+                    return False
+                # A scope too long for any rule still gets one, for the API to reject with a clear error
+                rule_bin = RuleBin()
+                rule_bin.add(scope)
+                bins.append(rule_bin)
+        return True
+
+    def share_groups(self, groups, bins):
+        candidates = sorted((user_ids for user_ids in groups if len(user_ids) > 1),
+                            key=lambda user_ids: (len(bins[user_ids]), sum(len(scope) for scope in groups[user_ids])))
+        for user_ids in candidates:
+            parts = self.partition(user_ids, bins)
+            if parts is None:
+                continue
+
+            trial_bins = {part: [rule_bin.copy() for rule_bin in bins[part]] for part in parts}
+            if all(self.fill(trial_bins[part], groups[user_ids]) for part in parts):
+                for part in parts:
+                    bins[part] = trial_bins[part]
+                    groups[part] = groups[part] + groups[user_ids]
+                del bins[user_ids]
+                del groups[user_ids]
+
+    # Disjoint user sets of other groups that together make up exactly user_ids, largest first
+    @staticmethod
+    def partition(user_ids, bins):
+        subsets = sorted((other for other in bins if other < user_ids),
+                         key=lambda other: (len(other), -len(bins[other])), reverse=True)
+        parts = []
+        remaining = set(user_ids)
+        for subset in subsets:
+            if subset <= remaining:
+                parts.append(subset)
+                remaining -= subset
+            if not remaining:
+                return parts
+        return None
@@ -0,0 +1,91 @@
+import datetime
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class RuleSyncer:
+    """
+    Runs the stream rule sync on a background thread, off the request path.
+    Every request gets a job id straight away. Requests arriving within debounce seconds of each other are
+    coalesced into one sync, which starts at most max_delay seconds after the first of them.
+    A request made while a sync is running is picked up by the next one, as it may have missed the change.
+    """
+
+    def __init__(self, sync, debounce=2.0, max_delay=10.0, history=1000) -> None:
+        self.sync = sync
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.history = history
+        self.lock = threading.Lock()
+        self.requested = threading.Condition(self.lock)
+        self.jobs = OrderedDict()
+        self.pending = []
+        self.first_request = None
+        self.last_request = None
+        self.thread = None
+
+    def request(self):
+        job = {"id": uuid.uuid4().hex, "status": PENDING, "requested_at": datetime.datetime.utcnow(),
+               "finished_at": None, "summary": None, "error": None}
+        with self.lock:
+            self.jobs[job["id"]] = job
+            while len(self.jobs) > self.history:
+                self.jobs.popitem(last=False)
+
+            self.pending.append(job)
+            self.last_request = time.monotonic()
+            if self.first_request is None:
+                self.first_request = self.last_request
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.requested.notify()
+        return job["id"]
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.requested.wait()
+                # Wait for the requests to go quiet, but not longer than max_delay after the first one
+                while True:
+                    deadline = min(self.last_request + self.debounce, self.first_request + self.max_delay)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.requested.wait(remaining)
+
+                jobs = self.pending
+                self.pending = []
+                self.first_request = None
+                for job in jobs:
+                    job["status"] = RUNNING
+
+            print("Syncing stream rules for {} scope changes".format(len(jobs)))
+            summary, error = None, None
+            try:
+                summary = self.sync()
+            except Exception as e:
+                print("Could not sync stream rules")
+                print(e)
+                error = str(e)
+
+            with self.lock:
+                for job in jobs:
+                    job["status"] = FAILED if error else DONE
+                    job["summary"] = summary
+                    job["error"] = error
+                    job["finished_at"] = datetime.datetime.utcnow()
@@ -0,0 +1,86 @@
+import re
+
+from services.keyword_matcher import KeywordAutomaton
+
+# Words, keeping the # of a hashtag, the @ of a mention and the $ of a cashtag (but not the @ inside an email address)
+TOKEN_PATTERN = re.compile(r"(?<!\w)[#@$]\w+|\w+")
+OPERATOR_PREFIXES = "#@$"
+
+
+# Split text into lower case word tokens, the way the stream matches keywords
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+# The tokens with their #, @ and $ dropped, so a plain keyword also matches the hashtag or mention of the word
+def strip_operators(tokens):
+    return [token.lstrip(OPERATOR_PREFIXES) for token in tokens]
+
+
+# A scope column holds comma separated terms. A quoted term is an exact phrase; an unquoted term with
+# several words needs all of them, anywhere in the tweet, as it does in a stream rule.
+# #word, @name and $word only match that hashtag, mention or cashtag, like the stream's operators; "word" matches
+# all three as the stream's tokenised keyword match does. Other operators (from:, lang:, -negation, OR, ...)
+# are not understood and are matched as plain words
+def parse_scope(scope):
+    clauses = []
+    for term in scope.split(","):
+        term = term.strip()
+        if not term:
+            continue
+        if len(term) > 1 and term.startswith('"') and term.endswith('"'):
+            phrases = [tuple(tokenize(term[1:-1]))]
+        else:
+            phrases = [(token,) for token in tokenize(term)]
+        phrases = [phrase for phrase in phrases if phrase]
+        if phrases:
+            clauses.append(frozenset(phrases))
+    return clauses
+
+
+class ScopeEvaluator:
+    """
+    Every user's scopes compiled into one matcher, so tweets from broad stream rules can be attributed locally.
+    users_for(*texts) returns the ids of the users with a scope term the texts match; a clause's phrases
+    may be spread over the texts, as over a retweet and the tweet it quotes in full.
+    Phrases are found with an automaton pass over the tokenised text, padded with spaces so a phrase
+    only matches whole tokens: once with #, @ and $ dropped for the plain phrases, and once more with
+    them kept when the text has any and a scope uses them.
+    """
+
+    def __init__(self, scope_rows) -> None:
+        phrase_ids = {}
+        # phrase id -> the (user_id, clause) pairs it is part of
+        self.clauses_by_phrase = {}
+        self.scope_count = 0
+        self.has_operators = False
+
+        for user_id, scope in scope_rows:
+            for clause in parse_scope(scope or ""):
+                self.scope_count += 1
+                self.has_operators = self.has_operators or any(
+                    token[0] in OPERATOR_PREFIXES for phrase in clause for token in phrase)
+                clause_ids = frozenset(phrase_ids.setdefault(phrase, len(phrase_ids)) for phrase in clause)
+                for phrase_id in clause_ids:
+                    self.clauses_by_phrase.setdefault(phrase_id, []).append((user_id, clause_ids))
+
+        self.automaton = KeywordAutomaton((" {} ".format(" ".join(phrase)), phrase_id)
+                                          for phrase, phrase_id in phrase_ids.items())
+
+    def users_for(self, *texts):
+        found = set()
+        for text in texts:
+            tokens = tokenize(text)
+            if not tokens:
+                continue
+            plain_tokens = strip_operators(tokens)
+            found |= self.automaton.search(" {} ".format(" ".join(plain_tokens)))
+            if self.has_operators and plain_tokens != tokens:
+                found |= self.automaton.search(" {} ".format(" ".join(tokens)))
+
+        user_ids = set()
+        for phrase_id in found:
+            for user_id, clause_ids in self.clauses_by_phrase[phrase_id]:
+                if user_id not in user_ids and clause_ids <= found:
+                    user_ids.add(user_id)
+        return user_ids
@@ -0,0 +1,33 @@
+import time
+
+from fastapi_sqlalchemy import db
+
+from core.models import schema
+from services.scope_evaluator import ScopeEvaluator
+
+
+class ScopeIndex:
+    """
+    Keeps the streamer's ScopeEvaluator in step with the scopes table. The table is small, so refresh()
+    simply recompiles all of it and swaps the new evaluator in whole.
+    """
+
+    def __init__(self) -> None:
+        self.evaluator = ScopeEvaluator([])
+
+    def refresh(self):
+        with db():
+            scope_rows = db.session.query(schema.Scope.user_id, schema.Scope.scope).all()
+        self.evaluator = ScopeEvaluator(scope_rows)
+
+    def watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Could not refresh scopes")
+                print(e)
+
+    def users_for(self, *texts):
+        return self.evaluator.users_for(*texts)
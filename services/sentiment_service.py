@@ -1,4 +1,8 @@
 # import flair
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
 
@@ -31,6 +35,9 @@ class SentimentService:
         # print("{:-<65} {}".format(text, result))
         return result
 
+    def get_sentiments(self, texts):
+        return [self.get_sentiment(text) for text in texts]
+
     def test(self):
         sentences = [
             "VADER is smart, handsome, and funny.",  # positive sentence example
@@ -54,5 +61,65 @@ class SentimentService:
         for sentence in sentences:
             print(self.get_sentiment(sentence))
 
+
+# Each pool worker keeps a single analyzer for its whole life so the lexicon is only loaded once per process
+_worker_service = None
+
+
+def _init_worker():
+    global _worker_service
+    _worker_service = SentimentService()
+
+
+def _score_chunk(texts):
+    return _worker_service.get_sentiments(texts)
+
+
+class SentimentEngine:
+    """
+    Scores batches of texts across a pool of processes.
+    SENTIMENT_WORKERS sets the pool size (defaults to the number of cores); 0 scores in the calling process.
+    """
+
+    def __init__(self, workers=None, min_chunk_size=None) -> None:
+        if workers is None:
+            workers = int(os.getenv('SENTIMENT_WORKERS', os.cpu_count() or 1))
+        if min_chunk_size is None:
+            min_chunk_size = int(os.getenv('SENTIMENT_MIN_CHUNK_SIZE', 50))
+        self.workers = workers
+        self.min_chunk_size = max(1, min_chunk_size)
+        self.service = None
+        self.pool = None
+
+        if self.workers > 0:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            # Start the workers (and load their lexicons) now rather than on the first batch
+            self.pool.submit(_score_chunk, []).result()
+        else:
+            self.service = SentimentService()
+
+    def get_sentiments(self, texts):
+        texts = list(texts)
+        if self.pool is None or len(texts) <= self.min_chunk_size:
+            return self._local_service().get_sentiments(texts)
+
+        # Split the batch evenly over the workers, but not into chunks too small to be worth the IPC
+        chunk_size = max(self.min_chunk_size, math.ceil(len(texts) / self.workers))
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+
+        results = []
+        for chunk_result in self.pool.map(_score_chunk, chunks):
+            results.extend(chunk_result)
+        return results
+
+    def _local_service(self):
+        if self.service is None:
+            self.service = SentimentService()
+        return self.service
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
 # x = SentimentService()
 # x.test()
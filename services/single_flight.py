@@ -0,0 +1,46 @@
+import threading
+
+
+class Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller computes, the ones arriving while it is
+    running wait for it and get the same result, or the same exception. Nothing is kept once it finishes.
+    """
+
+    def __init__(self, stats=None) -> None:
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, compute):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            if self.stats is not None:
+                self.stats.increment("coalesced_calls")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
@@ -0,0 +1,220 @@
+import json
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+HEADER = struct.Struct(">I")
+SEGMENT_NAME = "{:012d}.log"
+SEGMENT_PATTERN = re.compile(r"^(\d{12})\.log$")
+
+
+class SegmentLog:
+    """
+    Append-only log of raw stream lines kept in numbered segment files under one directory.
+    Records are length prefixed; an offset is the (segment, position) just past a record.
+    Writes are flushed straight away so readers see them, but only fsynced every fsync_every records
+    or fsync_interval seconds. Consumers checkpoint the offset they have fully processed, and segments
+    entirely before every checkpoint are deleted.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, fsync_every=100, fsync_interval=0.2) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.offsets_path = os.path.join(directory, "offsets.json")
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.appended = threading.Condition(self.lock)
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+        if segments:
+            self._truncate_torn_tail(self.segment_path(self.segment))
+        self.writer = open(self.segment_path(self.segment), "ab")
+
+    # fsync is batched, so a crash can leave half a record at the end of the last segment. Cut it off,
+    # or readers would take its remains as the header of the next record appended
+    @staticmethod
+    def _truncate_torn_tail(path):
+        size = os.path.getsize(path)
+        end = 0
+        with open(path, "r+b") as segment_file:
+            while True:
+                header = segment_file.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                record_end = segment_file.tell() + HEADER.unpack(header)[0]
+                if record_end > size:
+                    break
+                segment_file.seek(record_end)
+                end = record_end
+            if end < size:
+                print("Truncating torn spool record at {} in {}".format(end, path))
+                segment_file.truncate(end)
+
+    def segments(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, SEGMENT_NAME.format(segment))
+
+    def append(self, record):
+        with self.lock:
+            if self.writer.tell() >= self.segment_bytes:
+                self._roll()
+            self.writer.write(HEADER.pack(len(record)) + record)
+            self.writer.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+                self._sync()
+            offset = (self.segment, self.writer.tell())
+            self.appended.notify_all()
+        return offset
+
+    def sync(self):
+        with self.lock:
+            if self.unsynced:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self.writer.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def _roll(self):
+        self._sync()
+        self.writer.close()
+        self.segment += 1
+        self.writer = open(self.segment_path(self.segment), "ab")
+
+    # Blocking iterator over (offset, record) from the given offset onwards, waiting for new appends at the end
+    def read_from(self, offset=None):
+        segment, position = offset or (self.segments()[0], 0)
+        reader = open(self.segment_path(segment), "rb")
+        reader.seek(position)
+
+        while True:
+            position = reader.tell()
+            header = reader.read(HEADER.size)
+            if len(header) == HEADER.size:
+                length = HEADER.unpack(header)[0]
+                record = reader.read(length)
+                if len(record) == length:
+                    yield (segment, reader.tell()), record
+                    continue
+
+            # Nothing complete to read yet: wait for an append, or move on once the writer has rolled over
+            reader.seek(position)
+            with self.lock:
+                if os.path.getsize(self.segment_path(segment)) > position:
+                    continue
+                if self.segment > segment:
+                    reader.close()
+                    segment += 1
+                    reader = open(self.segment_path(segment), "rb")
+                    continue
+                self.appended.wait(timeout=1)
+
+    def committed(self, consumer):
+        return self.read_offsets().get(consumer)
+
+    def read_offsets(self):
+        try:
+            with open(self.offsets_path) as offsets_file:
+                return {consumer: tuple(offset) for consumer, offset in json.load(offsets_file).items()}
+        except (OSError, ValueError):
+            return {}
+
+    # Checkpoint a consumer's offset atomically, then drop segments no consumer still needs
+    def commit(self, consumer, offset):
+        offsets = self.read_offsets()
+        offsets[consumer] = offset
+        temporary_path = self.offsets_path + ".tmp"
+        with open(temporary_path, "w") as offsets_file:
+            json.dump(offsets, offsets_file)
+            offsets_file.flush()
+            os.fsync(offsets_file.fileno())
+        os.replace(temporary_path, self.offsets_path)
+
+        oldest_needed = min(segment for segment, _ in offsets.values())
+        for segment in self.segments():
+            if segment < oldest_needed and segment != self.segment:
+                os.remove(self.segment_path(segment))
+
+
+class OffsetTracker:
+    """
+    Works out which spool offset is safe to commit. Every record read is registered in order, the store
+    stage says how many downstream acknowledgements its posts need, and each stage acknowledges posts as
+    it finishes them. The committed offset only moves past records that are fully done, so a restart
+    resumes at the first record that was still in flight.
+    """
+
+    def __init__(self, spool, consumer, commit_interval=1.0) -> None:
+        self.spool = spool
+        self.consumer = consumer
+        self.commit_interval = commit_interval
+        self.lock = threading.Lock()
+        self.outstanding = OrderedDict()
+        self.done_offset = None
+        self.committed_offset = spool.committed(consumer)
+        self.last_commit = 0
+
+    def read(self, offset):
+        with self.lock:
+            self.outstanding[offset] = None
+
+    def expect(self, offset, acknowledgements):
+        with self.lock:
+            self.outstanding[offset] = (self.outstanding.get(offset) or 0) + acknowledgements
+            self._advance()
+
+    def acknowledge(self, offset):
+        with self.lock:
+            if self.outstanding.get(offset):
+                self.outstanding[offset] -= 1
+            self._advance()
+
+    # Commit the done offset even if nothing has come in since, so an idle or stopping worker does not redo work
+    def flush(self):
+        with self.lock:
+            if self.done_offset is not None and self.done_offset != self.committed_offset:
+                self._commit()
+
+    def watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print("Could not commit spool offset")
+                print(e)
+
+    def _advance(self):
+        while self.outstanding:
+            offset, remaining = next(iter(self.outstanding.items()))
+            if remaining != 0:
+                break
+            self.outstanding.popitem(last=False)
+            self.done_offset = offset
+
+        if self.done_offset is not None and self.done_offset != self.committed_offset \
+                and time.monotonic() - self.last_commit >= self.commit_interval:
+            self._commit()
+
+    def _commit(self):
+        self.spool.commit(self.consumer, self.done_offset)
+        self.committed_offset = self.done_offset
+        self.last_commit = time.monotonic()
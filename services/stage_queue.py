@@ -0,0 +1,104 @@
+import asyncio
+import json
+import os
+import time
+
+BLOCK = "block"
+DROP = "drop"
+SPILL = "spill"
+POLICIES = (BLOCK, DROP, SPILL)
+
+
+class BoundedStageQueue:
+    """
+    asyncio queue between two ingest stages with a fixed capacity and a policy for when it is full:
+      block - the producer waits for room, so a slow stage pushes back on the one before it
+      drop  - the new item is discarded, counted and handed to on_drop so whoever tracks it can let go
+      spill - the new item is appended to a file and read back, in order, once the consumer catches up
+    """
+
+    def __init__(self, name, maxsize, policy=BLOCK, spill_dir=None, serialize=None, deserialize=None,
+                 on_drop=None) -> None:
+        if policy not in POLICIES:
+            raise ValueError("Unknown backpressure policy {}, expected one of {}".format(policy, POLICIES))
+
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.spilled = 0
+        self.on_drop = on_drop
+
+        self.serialize = serialize or (lambda item: json.dumps(item).encode())
+        self.deserialize = deserialize or json.loads
+        self.spill_path = None
+        self.spill_pending = 0
+        self.spill_writer = None
+        self.spill_reader = None
+        if policy == SPILL:
+            os.makedirs(spill_dir or ".", exist_ok=True)
+            self.spill_path = os.path.join(spill_dir or ".", "{}.spill".format(name))
+            self._reset_spill()
+
+    async def put(self, item):
+        if self.policy == BLOCK:
+            await self.queue.put(item)
+        elif self.policy == DROP:
+            if self.queue.full():
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(item)
+            else:
+                self.queue.put_nowait(item)
+        # Once anything is on disk keep spilling, so items still come out in the order they went in
+        elif self.spill_pending or self.queue.full():
+            self.spill_writer.write(self.serialize(item) + b"\n")
+            self.spill_writer.flush()
+            self.spill_pending += 1
+            self.spilled += 1
+        else:
+            self.queue.put_nowait(item)
+
+    # Wait for one item, then take more until max_items or max_wait seconds after the first one
+    async def get_batch(self, max_items, max_wait):
+        self._refill()
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + max_wait
+
+        while len(batch) < max_items:
+            self._refill()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        self._refill()
+        return batch
+
+    def depth(self):
+        return self.queue.qsize() + self.spill_pending
+
+    def stats(self):
+        return {"depth": self.depth(), "capacity": self.maxsize, "policy": self.policy,
+                "dropped": self.dropped, "spilled": self.spilled, "spill_pending": self.spill_pending}
+
+    # Move spilled items back into memory while there is room
+    def _refill(self):
+        while self.spill_pending and not self.queue.full():
+            line = self.spill_reader.readline()
+            self.spill_pending -= 1
+            self.queue.put_nowait(self.deserialize(line))
+
+        if self.spill_path and not self.spill_pending and self.spill_reader.tell():
+            self._reset_spill()
+
+    def _reset_spill(self):
+        if self.spill_writer is not None:
+            self.spill_writer.close()
+            self.spill_reader.close()
+        self.spill_writer = open(self.spill_path, "wb")
+        self.spill_reader = open(self.spill_path, "rb")
@@ -0,0 +1,26 @@
+from typing import NamedTuple, Optional, Tuple
+
+
+class TweetRecord(NamedTuple):
+    """
+    A stored tweet as it travels from the store stage to scoring. Only what scoring needs is kept,
+    not the row or its payload.
+    """
+    id: int
+    text: str
+    # (segment, position) of the spool record it was read from, None when the spool is off
+    spool_offset: Optional[Tuple[int, int]] = None
+
+
+class PostRecord(NamedTuple):
+    """
+    A stored post as it travels from the store stage to categorising, with its tweet's text to match
+    the user's keywords against.
+    """
+    id: int
+    user_id: int
+    tweet_id: int
+    text: str
+    created_at: str
+    spool_offset: Optional[Tuple[int, int]] = None
+
@@ -0,0 +1,111 @@
+import random
+import time
+
+NETWORK = "network"
+STALL = "stall"
+DISCONNECT = "disconnect"
+SERVER = "server"
+CLIENT = "client"
+RATE_LIMIT = "rate_limit"
+
+
+class BackoffPolicy:
+    """ Capped exponential backoff with jitter: each delay is drawn from the upper half of the current step. """
+
+    def __init__(self, initial, maximum, multiplier=2.0) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.attempts = 0
+
+    def next_delay(self):
+        step = min(self.maximum, self.initial * self.multiplier ** self.attempts)
+        self.attempts += 1
+        return random.uniform(step / 2, step)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class StreamSupervisor:
+    """
+    Decides how long the stream reader waits before reconnecting, and keeps score of the connection.
+    Network errors, stalls and dropped connections retry quickly; 5xx and other error statuses back off
+    for longer, and 429 longest, honouring the rate limit reset time when the response has one.
+    A connection counts as stalled when nothing, not even a keep-alive newline, arrived for stall_timeout
+    seconds; the reader uses it as its read timeout.
+    A 200 alone does not reset the backoff, as a stream can accept and drop straight away: the backoff is reset
+    when the first line arrives, and the rate limit backoff only once the connection has been up healthy_after seconds.
+    """
+
+    def __init__(self, stats, stall_timeout=30, healthy_after=60) -> None:
+        self.stats = stats
+        self.stall_timeout = stall_timeout
+        self.healthy_after = healthy_after
+        self.policies = {
+            NETWORK: BackoffPolicy(0.25, 16),
+            STALL: BackoffPolicy(0.25, 16),
+            DISCONNECT: BackoffPolicy(0.25, 16),
+            SERVER: BackoffPolicy(5, 320),
+            CLIENT: BackoffPolicy(5, 320),
+            RATE_LIMIT: BackoffPolicy(60, 960),
+        }
+        self.last_activity = time.monotonic()
+        self.disconnected_at = None
+        self.connected_at = None
+        # Policies still to reset on this connection
+        self.pending_resets = set()
+
+    @staticmethod
+    def classify_status(status_code):
+        if status_code == 429:
+            return RATE_LIMIT
+        if status_code >= 500:
+            return SERVER
+        return CLIENT
+
+    # Seconds until the rate limit window resets, from Twitter's x-rate-limit-reset header
+    @staticmethod
+    def retry_after(response_headers):
+        reset = response_headers.get("x-rate-limit-reset")
+        try:
+            return max(0.0, int(reset) - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    # A failure while reading counts as a stall when it came after a full window of silence
+    def read_failure(self):
+        return STALL if time.monotonic() - self.last_activity >= self.stall_timeout * 0.9 else NETWORK
+
+    def connected(self):
+        self.last_activity = time.monotonic()
+        if self.disconnected_at is not None:
+            self.stats.increment("stream_downtime_seconds", time.monotonic() - self.disconnected_at)
+            self.disconnected_at = None
+        self.connected_at = time.monotonic()
+        self.pending_resets = set(self.policies)
+
+    # Called for every line read, keep-alive newlines included
+    def activity(self):
+        self.last_activity = time.monotonic()
+        if not self.pending_resets:
+            return
+        healthy = self.last_activity - self.connected_at >= self.healthy_after
+        for kind in list(self.pending_resets):
+            if kind != RATE_LIMIT or healthy:
+                self.policies[kind].reset()
+                self.pending_resets.discard(kind)
+
+    # Record a failed or dropped connection and return how long to wait before reconnecting
+    def failed(self, kind, retry_after=None):
+        if self.disconnected_at is None:
+            self.disconnected_at = time.monotonic()
+        self.pending_resets = set()
+        self.stats.increment("stream_reconnects")
+        self.stats.increment("stream_{}_errors".format(kind))
+
+        delay = self.policies[kind].next_delay()
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        print("Stream {}, reconnecting in {:.1f} seconds".format(kind.replace("_", " "), delay))
+        return delay
@@ -0,0 +1,4 @@
+import os
+
+# core.models.database builds its engine on import; the db tests run against an in-memory SQLite instead of MySQL
+os.environ.setdefault("MYSQLURLPATH", "sqlite://")
@@ -0,0 +1,35 @@
+from services.keyword_matcher import KeywordAutomaton, KeywordMatcher
+
+
+def test_overlapping_patterns_are_all_found():
+    automaton = KeywordAutomaton([("he", 1), ("she", 2), ("his", 3), ("hers", 4)])
+    assert automaton.search("ushers") == {1, 2, 4}
+
+
+def test_pattern_that_is_a_suffix_of_another_is_found():
+    automaton = KeywordAutomaton([("accra", 1), ("cra", 2), ("greater accra", 3)])
+    assert automaton.search("greater accra") == {1, 2, 3}
+    assert automaton.search("a cra") == {2}
+
+
+def test_pattern_found_after_a_failed_partial_match():
+    automaton = KeywordAutomaton([("abcd", 1), ("bce", 2)])
+    assert automaton.search("abce") == {2}
+
+
+def test_no_patterns_or_no_match():
+    assert KeywordAutomaton([]).search("anything") == set()
+    assert KeywordAutomaton([("ghana", 1)]).search("togo") == set()
+
+
+def test_matcher_is_per_user_and_case_insensitive():
+    matcher = KeywordMatcher.from_keyword_rows([
+        (1, 10, "Election, vote"),
+        (1, 11, "football"),
+        (2, 20, "vote"),
+    ])
+    assert matcher.match(1, "Go VOTE in the election") == {10}
+    assert matcher.match(1, "football and voters") == {10, 11}
+    assert matcher.match(2, "football") == set()
+    assert matcher.match(3, "vote") == set()
+    assert matcher.match(1, "") == set()
@@ -0,0 +1,78 @@
+import datetime
+
+import pytest
+
+from core.models import schema
+from core.models.database import engine
+from services.post_deduplicator import PostDeduplicator, unfinished_stages
+
+TABLES = [schema.Tweet.__table__, schema.Post.__table__,
+          schema.TweetSentimentScore.__table__, schema.PostAboutCategory.__table__]
+
+
+@pytest.fixture
+def connection():
+    schema.Base.metadata.create_all(engine, tables=TABLES)
+    with engine.connect() as connection:
+        yield connection
+    schema.Base.metadata.drop_all(engine, tables=TABLES)
+
+
+def post_row(user_id, data_id):
+    return dict(user_id=user_id, data_id=data_id, created_at=datetime.datetime.utcnow(), offset=None)
+
+
+# Stores a tweet and one post of it, as the store stage does
+def store(connection, tweet_id, data_id, post_id, user_id):
+    connection.execute(schema.Tweet.__table__.insert(), id=tweet_id, data_id=data_id, text="text")
+    connection.execute(schema.Post.__table__.insert(), id=post_id, user_id=user_id, tweet_id=tweet_id,
+                       created_at=datetime.datetime.utcnow())
+
+
+def test_new_rows_skip_duplicates_within_the_batch(connection):
+    deduplicator = PostDeduplicator(1000)
+    new_indexes, stored_indexes = deduplicator.new_row_indexes(
+        connection, [post_row(1, "a"), post_row(1, "a"), post_row(2, "a")])
+    assert new_indexes == [0, 2]
+    assert stored_indexes == {}
+
+
+def test_stored_posts_come_back_with_their_ids(connection):
+    store(connection, 5, "a", 7, 1)
+    deduplicator = PostDeduplicator(1000)
+    deduplicator.remember([post_row(1, "a")])
+
+    new_indexes, stored_indexes = deduplicator.new_row_indexes(
+        connection, [post_row(1, "a"), post_row(2, "a"), post_row(1, "a")])
+    assert new_indexes == [1]
+    assert stored_indexes == {0: (7, 5)}
+
+
+def test_unfinished_stages(connection):
+    store(connection, 5, "a", 7, 1)
+    store(connection, 6, "b", 8, 1)
+    connection.execute(schema.TweetSentimentScore.__table__.insert(), tweet_id=6, sentiment="positive", score=0.9)
+    connection.execute(schema.PostAboutCategory.__table__.insert(), post_id=8, category_id=3)
+
+    assert unfinished_stages(connection, [5, 6], [7, 8]) == ({5}, {7})
+    assert unfinished_stages(connection, [], []) == (set(), set())
+
+
+def test_crash_between_store_and_score(connection):
+    # The store stage committed the tweet and post, then the worker died before scoring or categorising them
+    store(connection, 5, "a", 7, 1)
+
+    # After the restart the duplicate filter is reloaded and the spool replays the record
+    deduplicator = PostDeduplicator(1000)
+    deduplicator.load_recent(3)
+    new_indexes, stored_indexes = deduplicator.new_row_indexes(connection, [post_row(1, "a")])
+    assert new_indexes == []
+    assert stored_indexes == {0: (7, 5)}
+
+    # so the post goes back to both stages rather than being acknowledged as a duplicate
+    assert unfinished_stages(connection, [5], [7]) == ({5}, {7})
+
+    connection.execute(schema.TweetSentimentScore.__table__.insert(), tweet_id=5, sentiment="negative", score=0.8)
+    connection.execute(schema.PostAboutCategory.__table__.insert(), post_id=7, category_id=3)
+    # and once they are done, another replay has nothing left to do
+    assert unfinished_stages(connection, [5], [7]) == (set(), set())
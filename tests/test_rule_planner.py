@@ -0,0 +1,54 @@
+import random
+
+from services.rule_planner import RulePlanner
+
+
+def split_rule(value):
+    return value.split(" OR ")
+
+
+def check_plan(scope_users, plan, max_length, max_clauses):
+    tagged_users = {scope: set() for scope in scope_users}
+    for rule in plan.rules:
+        scopes = split_rule(rule["value"])
+        assert len(rule["value"]) <= max_length
+        assert len(scopes) <= max_clauses
+        tag = set(rule["tag"].split(","))
+        for scope in scopes:
+            # Every user in the tag wants every scope in the rule
+            assert tag <= {str(user_id) for user_id in scope_users[scope]}
+            tagged_users[scope] |= tag
+    # and every user of a scope gets its tweets from some rule
+    for scope, user_ids in scope_users.items():
+        assert tagged_users[scope] == {str(user_id) for user_id in user_ids}
+
+
+def test_scopes_of_the_same_users_share_a_rule():
+    scope_users = {"ghana": [1, 2], "accra": [1, 2], "election": [3]}
+    plan = RulePlanner().plan(scope_users)
+    check_plan(scope_users, plan, 512, 30)
+    assert sorted(rule["tag"] for rule in plan.rules) == ["1,2", "3"]
+
+
+def test_shared_scope_is_spread_over_the_users_rules():
+    scope_users = {"ghana": [1], "togo": [2], "accra": [1, 2]}
+    plan = RulePlanner().plan(scope_users)
+    check_plan(scope_users, plan, 512, 30)
+    assert len(plan.rules) == 2
+    assert plan.rules_saved() == 1
+
+
+def test_length_and_clause_limits():
+    scope_users = {"scope{}".format(number): [1] for number in range(10)}
+    plan = RulePlanner(max_length=30, max_clauses=3).plan(scope_users)
+    check_plan(scope_users, plan, 30, 3)
+    assert len(plan.rules) == 4
+
+
+def test_random_scopes_keep_tags_within_their_users():
+    generator = random.Random(7)
+    words = ["word{}".format(number) for number in range(60)]
+    scope_users = {word: generator.sample(range(1, 9), generator.randint(1, 4)) for word in words}
+    plan = RulePlanner(max_length=80, max_clauses=5).plan(scope_users)
+    check_plan(scope_users, plan, 80, 5)
+    assert len(plan.rules) <= plan.baseline_rule_count
@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("fastapi_sqlalchemy")
+
+from controllers.rules_controller import Rules  # noqa: E402
+
+
+def rule(value, tag="1", rule_id=None):
+    return {"value": value, "tag": tag, "id": rule_id or value}
+
+
+@pytest.fixture
+def rules():
+    rules = Rules()
+    rules.max_twitter_rules = 5
+    return rules
+
+
+def test_new_rules_are_added_before_stale_ones_are_deleted(rules):
+    steps = rules.order_changes([rule("b")], [rule("a")], live_count=2)
+    assert steps == [("delete", []), ("add", [rule("b")]), ("delete", [rule("a")]), ("add", [])]
+
+
+def test_rule_whose_tag_changed_is_re_added_after_its_old_version_is_deleted(rules):
+    steps = rules.order_changes([rule("a", "1,2")], [rule("a", "1")], live_count=1)
+    assert steps == [("delete", []), ("add", []), ("delete", [rule("a", "1")]), ("add", [rule("a", "1,2")])]
+
+
+def test_stale_rules_make_room_at_the_rule_cap(rules):
+    live = [rule(value) for value in "abcde"]
+    steps = rules.order_changes([rule("x"), rule("y")], live[:3], live_count=len(live))
+    assert steps == [("delete", live[:2]), ("add", [rule("x"), rule("y")]), ("delete", live[2:3]), ("add", [])]
+    # Live rules never go past the cap
+    live_count = len(live)
+    for action, changed in steps:
+        live_count += len(changed) if action == "add" else -len(changed)
+        assert live_count <= rules.max_twitter_rules
+
+
+def test_planned_rules_are_diffed_by_value_and_tag():
+    rules_to_add, rules_to_delete = Rules.diff_rules([rule("a"), rule("b", "2")], [rule("a"), rule("b", "1")])
+    assert rules_to_add == [rule("b", "2")]
+    assert rules_to_delete == [rule("b", "1")]
@@ -0,0 +1,73 @@
+import pytest
+
+from services.scope_evaluator import ScopeEvaluator, parse_scope, tokenize
+
+SCOPES = [
+    (1, '"black stars"'),
+    (2, "election accra"),
+    (3, "#ghana"),
+    (4, "ghana"),
+    (5, "@bbc, $gold"),
+]
+
+
+@pytest.fixture
+def evaluator():
+    return ScopeEvaluator(SCOPES)
+
+
+def test_tokenize_keeps_hashtags_and_mentions_but_not_email_at_signs():
+    assert tokenize("Go #Ghana! cc @BBC, mail a@b.com $GOLD") == \
+        ["go", "#ghana", "cc", "@bbc", "mail", "a", "b", "com", "$gold"]
+
+
+def test_parse_scope():
+    assert parse_scope('"Black Stars", election accra,') == [
+        frozenset({("black", "stars")}), frozenset({("election",), ("accra",)})]
+
+
+def test_phrase_needs_its_words_together(evaluator):
+    assert evaluator.users_for("The Black Stars won") == {1}
+    assert evaluator.users_for("stars in a black sky") == set()
+
+
+def test_words_of_a_term_are_all_needed_anywhere(evaluator):
+    assert evaluator.users_for("Accra votes in the election") == {2}
+    assert evaluator.users_for("election day") == set()
+
+
+def test_hashtag_term_only_matches_the_hashtag(evaluator):
+    assert evaluator.users_for("Go #Ghana") == {3, 4}
+    assert evaluator.users_for("Ghana news") == {4}
+
+
+def test_mention_and_cashtag_terms(evaluator):
+    assert evaluator.users_for("RT @BBC: news") == {5}
+    assert evaluator.users_for("the bbc says") == set()
+    assert evaluator.users_for("mail me at news@bbc.com") == set()
+    assert evaluator.users_for("$GOLD is up") == {5}
+
+
+def test_retweet_is_matched_with_the_full_text_of_the_retweeted_tweet(evaluator):
+    truncated = "RT @someone: Huge crowds in Accra as the…"
+    full = "Huge crowds in Accra as the election results come in"
+    assert evaluator.users_for(truncated) == set()
+    assert evaluator.users_for(truncated, full) == {2}
+    # A clause's words may be spread over the texts, but a phrase may not
+    assert evaluator.users_for("election", "accra") == {2}
+    assert evaluator.users_for("black", "stars") == set()
+
+
+def test_no_scopes_or_no_text():
+    assert ScopeEvaluator([]).users_for("anything") == set()
+    assert ScopeEvaluator(SCOPES).users_for("", None) == set()
+
+
+def test_scope_index_passes_every_text_on():
+    pytest.importorskip("fastapi_sqlalchemy")
+    from services.scope_index import ScopeIndex
+
+    scope_index = ScopeIndex()
+    scope_index.evaluator = ScopeEvaluator(SCOPES)
+    assert scope_index.users_for("RT @someone: Huge crowds in…", "Huge crowds for the election in Accra") == {2}
+    assert scope_index.users_for("Go #Ghana") == {3, 4}
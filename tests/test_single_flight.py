@@ -0,0 +1,59 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.pipeline_stats import PipelineStats
+from services.single_flight import SingleFlight
+
+CALLERS = 8
+
+
+# Runs do(key, compute) from CALLERS threads and releases compute once they are all waiting on it
+def call_concurrently(flights, stats, compute):
+    release = threading.Event()
+    calls = []
+
+    def blocked_compute():
+        calls.append(1)
+        release.wait(5)
+        return compute()
+
+    with ThreadPoolExecutor(max_workers=CALLERS) as executor:
+        futures = [executor.submit(flights.do, "key", blocked_compute) for _ in range(CALLERS)]
+        while stats.count("coalesced_calls") < CALLERS - 1:
+            time.sleep(0.01)
+        release.set()
+        return calls, futures
+
+
+def test_concurrent_calls_compute_once():
+    stats = PipelineStats()
+    flights = SingleFlight(stats)
+    calls, futures = call_concurrently(flights, stats, lambda: 42)
+    assert len(calls) == 1
+    assert [future.result() for future in futures] == [42] * CALLERS
+    assert flights.flights == {}
+
+
+def test_exception_reaches_every_caller():
+    stats = PipelineStats()
+    flights = SingleFlight(stats)
+
+    def fail():
+        raise ValueError("query failed")
+
+    calls, futures = call_concurrently(flights, stats, fail)
+    assert len(calls) == 1
+    for future in futures:
+        with pytest.raises(ValueError, match="query failed"):
+            future.result()
+    # Nothing is kept, the next call computes again
+    assert flights.do("key", lambda: 1) == 1
+
+
+def test_different_keys_do_not_share():
+    flights = SingleFlight()
+    assert flights.do("a", lambda: 1) == 1
+    assert flights.do("b", lambda: 2) == 2
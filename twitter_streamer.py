@@ -1,4 +1,7 @@
+import asyncio
+
 from controllers.streams_controller import MyTwitter
+from services.async_ingest import AsyncIngestRuntime
 from fastapi import FastAPI
 # Import os and dotenv to read data from env file
 import os
@@ -16,4 +19,17 @@ app.add_middleware(DBSessionMiddleware, db_url=os.getenv('MYSQLURLPATH'))
 
 print("Starting streamer => ")
 
-twitter_streamer = MyTwitter()
+
+# The runtime's queues are made inside the running loop, asyncio.Queue binds to the current loop on Python <= 3.9
+async def run_async_ingest(twitter, headers):
+    await AsyncIngestRuntime(twitter).run(headers)
+
+
+# INGEST_RUNTIME=asyncio runs the stages as coroutines over bounded queues instead of threads
+if os.getenv('INGEST_RUNTIME', 'threads') == 'asyncio':
+    twitter_streamer = MyTwitter(live=False, threaded=False)
+    headers = twitter_streamer.create_headers(os.getenv('TWITTER_BEARER_TOKEN'))
+    twitter_streamer.reset_rules(headers)
+    asyncio.run(run_async_ingest(twitter_streamer, headers))
+else:
+    twitter_streamer = MyTwitter()